@@ -0,0 +1,204 @@
+# Copyright 2016 (C) Thiago Pinto.
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+__author__ = "Thiago Pinto"
+
+from functools import cached_property
+import numpy as np
+from column_table import ColumnTable
+
+
+class BacklogIndex:
+    """
+    Integer index of the backlog and the teams.
+
+    Stories and teams are mapped once to positions 0..n-1 so that a solution
+    can be stored as a genome: a fixed-length integer array where the slot of
+    each story holds the index of the team it is assigned to, or -1 when the
+    story is not in the sprint.
+
+    When planning several sprints the genome holds sprint * teams + team, one
+    value (a team slot) per team and sprint; with a single sprint team slots
+    are the team indexes.
+
+    The numeric columns used by the fitness function are stored as vectors.
+    Per story and team slot tables have an extra last column of zeros, so
+    indexing them with a genome maps the -1 slots (story not planned) to zero.
+
+    The index is built from the columns of the backlog and teams tables (see
+    ColumnTable). The per story dicts and lists only needed by list genomes
+    are built on first use.
+    """
+
+    def __init__(self, backlog, teams, sprints=1):
+        """
+        Build the story and team indexes
+
+        @param backlog: the project stories, {story_id: data} or ColumnTable
+        @param teams: the teams, {team_id: data} or ColumnTable
+        @param sprints: number of sprints planned
+        """
+        if isinstance(backlog, dict):
+            backlog = ColumnTable.from_dict(backlog)
+        if isinstance(teams, dict):
+            teams = ColumnTable.from_dict(teams)
+
+        self.story_ids = backlog.ids.tolist()
+        self.team_ids = teams.ids.tolist()
+        self.team_index = {team_id: i for i, team_id in enumerate(self.team_ids)}
+
+        self.backlog_stories = np.flatnonzero(backlog.status_is('backlog'))
+        # Position of each story in backlog_stories, -1 if not in backlog status
+        self.backlog_rank = np.full(len(self.story_ids), -1, dtype=np.intp)
+        self.backlog_rank[self.backlog_stories] = np.arange(len(self.backlog_stories))
+        self.rank_dtype = np.min_scalar_type(max(len(self.backlog_stories) - 1, 0))
+
+        self.sprints = sprints
+        self.team_slots = len(self.team_ids) * sprints
+        # Smallest signed type able to hold every team slot and -1
+        self.genome_dtype = np.min_scalar_type(-self.team_slots - 1)
+
+        self.story_time = np.asarray(backlog['time'], dtype=float)
+        self.team_efficiency = np.asarray(teams['efficiency'], dtype=float)
+        self.team_cost = np.asarray(teams['cost'], dtype=float)
+        self.team_available_time = np.asarray(teams['available_time'], dtype=float)
+        # Available time of each team slot, every sprint has the same capacity
+        self.slot_available_time = np.tile(self.team_available_time, sprints)
+
+        # story x (team slot + none) tables
+        self.story_hours = np.zeros((len(self.story_ids), self.team_slots + 1))
+        self.story_hours[:, :-1] = np.tile(self.story_time[:, None] / self.team_efficiency, \
+            sprints)
+        self.story_cost = np.zeros((len(self.story_ids), self.team_slots + 1))
+        self.story_cost[:, :-1] = np.tile(self.story_time[:, None] * self.team_efficiency \
+            * self.team_cost, sprints)
+
+        self.build_dependencies(backlog)
+
+
+    def build_dependencies(self, backlog):
+        """
+        Parses the dependency column once into the dependency index.
+
+        Dependencies already done never invalidate a solution, so only
+        dependencies in backlog or working status are kept:
+            - edge arrays: story dependency_source[i] depends on story
+              dependency_target[i], dependency_working[i] tells if the
+              dependency is being worked on. Edges are sorted by source, the
+              edges of story s are dependency_indptr[s]:dependency_indptr[s + 1]
+            - dependent_edges: the edges sorted by target, the edges of the
+              stories that depend on story s are
+              dependent_edges[dependent_indptr[s]:dependent_indptr[s + 1]]
+
+        @param backlog: the project stories table
+        """
+        self.story_working = backlog.status_is('working')
+        indptr = backlog['dependency_indptr']
+        source = np.repeat(np.arange(len(self.story_ids)), np.diff(indptr))
+        target = np.asarray(backlog['dependency_indices'])
+        pending = self.story_working[target] | backlog.status_is('backlog')[target]
+
+        self.dependency_source = source[pending]
+        self.dependency_target = target[pending]
+        self.dependency_working = self.story_working[self.dependency_target]
+        self.dependency_indptr = np.zeros(len(self.story_ids) + 1, dtype=np.intp)
+        np.cumsum(np.bincount(self.dependency_source, minlength=len(self.story_ids)), \
+            out=self.dependency_indptr[1:])
+        self.dependent_edges = np.argsort(self.dependency_target, kind='stable')
+        self.dependent_indptr = np.zeros(len(self.story_ids) + 1, dtype=np.intp)
+        np.cumsum(np.bincount(self.dependency_target, minlength=len(self.story_ids)), \
+            out=self.dependent_indptr[1:])
+
+
+    @cached_property
+    def story_index(self):
+        """
+        {story_id: story index}
+        """
+        return {story_id: i for i, story_id in enumerate(self.story_ids)}
+
+
+    @cached_property
+    def backlog_ids(self):
+        """
+        The ids of the stories in backlog status.
+        """
+        return [self.story_ids[story] for story in self.backlog_stories]
+
+
+    @cached_property
+    def working_stories(self):
+        """
+        The ids of the stories being worked on.
+        """
+        return {self.story_ids[story] for story in np.flatnonzero(self.story_working)}
+
+
+    @cached_property
+    def story_dependencies(self):
+        """
+        {story_id: [dependency_id]}, only the dependencies kept by build_dependencies.
+        """
+        story_dependencies = {story_id: [] for story_id in self.story_ids}
+        for source, target in zip(self.dependency_source.tolist(), \
+            self.dependency_target.tolist()):
+            story_dependencies[self.story_ids[source]].append(self.story_ids[target])
+
+        return story_dependencies
+
+
+    def story_edges(self, story):
+        """
+        Returns the dependency edges that have @param story as one of the ends.
+
+        @param story: the story index
+        """
+        edges = np.concatenate((
+            np.arange(self.dependency_indptr[story], self.dependency_indptr[story + 1]),
+            self.dependent_edges[self.dependent_indptr[story]:self.dependent_indptr[story + 1]]))
+        # A story that depends on itself has the same edge on both lists
+        return np.unique(edges)
+
+
+    def empty_genomes(self, size):
+        """
+        Returns @param size genomes without any story assigned.
+
+        @param size: number of genomes
+        """
+        return np.full((size, len(self.story_ids)), -1, dtype=self.genome_dtype)
+
+
+    def encode(self, solution):
+        """
+        Converts a list of attributions {'team_id', 'story_id'} to a genome.
+        When planning several sprints attributions also have a 'sprint'.
+
+        @param solution: the story assignment to each team
+        """
+        genome = self.empty_genomes(1)[0]
+        for attribution in solution:
+            genome[self.story_index[attribution['story_id']]] = \
+                attribution.get('sprint', 0) * len(self.team_ids) \
+                + self.team_index[attribution['team_id']]
+
+        return genome
+
+
+    def decode(self, genome):
+        """
+        Converts a genome back to a list of attributions {'team_id', 'story_id'},
+        with the 'sprint' of each one when planning several sprints.
+
+        @param genome: the story slot -> team slot array
+        """
+        teams = len(self.team_ids)
+        if self.sprints == 1:
+            return [{'team_id': self.team_ids[genome[story]], 'story_id': self.story_ids[story]} \
+                for story in np.flatnonzero(genome >= 0)]
+
+        return [{'team_id': self.team_ids[genome[story] % teams], \
+            'story_id': self.story_ids[story], 'sprint': int(genome[story] // teams)} \
+            for story in np.flatnonzero(genome >= 0)]
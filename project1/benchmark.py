@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+#
+# Copyright 2016 (C) Thiago Pinto.
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+"""
+Benchmarks of the story selection genetic algorithm.
+
+    ./benchmark.py startup [--repeat N] [<backlog.csv> <teams.csv>]
+    ./benchmark.py generate <backlog.csv> <teams.csv> [--stories N] [--teams N]
+        [--dependency-density D] [--seed SEED]
+    ./benchmark.py ga [--stories N ...] [--teams N] [--dependency-density D]
+        [--population N] [--generations N] [--genome {list,array}]
+
+startup: time from the first import of the algorithm modules to the end of
+the first generation, measured on fresh interpreters.
+generate: writes a synthetic backlog and teams files.
+ga: generations/s, fitness evaluations/s, peak memory and final fitness of
+each reproduction_type and selection_strategy on synthetic backlogs, each
+case measured on a fresh interpreter.
+"""
+__author__ = "Thiago Pinto"
+
+import sys
+import csv
+import json
+import time
+import random
+import argparse
+import resource
+import statistics
+import subprocess
+
+# Small configuration, only the first generation is measured
+STARTUP_CONFIG = {
+    'population_size': 100,
+    'reproduction_type': 'tournament',
+    'reproduction_tournament_size': 3,
+    'mutation_probability': 0.1,
+    'selection_strategy': 'elitism',
+    'max_generations': 1,
+    'plot': False
+}
+
+REPRODUCTION_TYPES = ['none', 'tournament', 'roulette']
+SELECTION_STRATEGIES = ['elitism', 'steadyState']
+
+# ru_maxrss units per megabyte: bytes on macOS, kilobytes on Linux
+MAXRSS_PER_MB = 1024 * 1024 if sys.platform == 'darwin' else 1024
+
+# Story sizes of the synthetic backlogs
+STORY_TIMES = [1, 2, 3, 5, 8, 13, 20, 40]
+
+
+def main():
+    """
+    Run the benchmark selected on the command line and print its report.
+    """
+    args = parse_args()
+
+    if args.benchmark == 'startup':
+        report = startup(args.backlog, args.teams, args.repeat)
+    elif args.benchmark == 'startup-run':
+        report = first_generation_time(args.backlog, args.teams)
+    elif args.benchmark == 'generate':
+        backlog, teams = synthetic_backlog(args.stories, args.teams, \
+            args.dependency_density, args.seed)
+        write_csv(args.backlog, backlog, ['story_desc', 'dependency', 'priority', 'time', 'status'])
+        write_csv(args.teams_file, teams, ['efficiency', 'cost', 'available_time'])
+        report = {'stories': len(backlog), 'teams': len(teams)}
+    elif args.benchmark == 'ga':
+        report = ga(args)
+    elif args.benchmark == 'ga-run':
+        report = ga_run(args)
+
+    print(json.dumps(report, indent=2))
+
+
+def startup(backlog_file, teams_file, repeat):
+    """
+    Measures first_generation_time on @param repeat new interpreters and
+    returns the median of each time and the time of the whole process.
+
+    @param backlog_file: backlog in CSV
+    @param teams_file: team specifications in CSV
+    @param repeat: number of processes
+    """
+    runs = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, __file__, 'startup-run', backlog_file, \
+            teams_file], check=True, stdout=subprocess.PIPE).stdout
+        run = json.loads(output)
+        run['process'] = time.perf_counter() - start
+        runs.append(run)
+
+    return {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+
+
+def first_generation_time(backlog_file, teams_file):
+    """
+    Returns the seconds from the start of the imports to: the end of the
+    imports, the parsed input files and the end of the first generation.
+
+    Must run on a fresh interpreter, the algorithm modules are only imported here.
+
+    @param backlog_file: backlog in CSV
+    @param teams_file: team specifications in CSV
+    """
+    import io
+    import contextlib
+
+    start = time.perf_counter()
+    import main
+    from story_selector import StorySelector
+    imported = time.perf_counter()
+
+    backlog = main.parse_csv(backlog_file)
+    teams = main.parse_csv(teams_file)
+    parsed = time.perf_counter()
+
+    generations = []
+    story_selector = StorySelector(STARTUP_CONFIG, backlog, teams, 'startup', \
+        metrics=lambda record: generations.append(time.perf_counter()))
+    with contextlib.redirect_stdout(io.StringIO()):
+        story_selector.run()
+
+    return {'import': imported - start, 'parse': parsed - start, \
+        'first_generation': generations[0] - start}
+
+
+def synthetic_backlog(stories, teams, dependency_density, seed):
+    """
+    Returns a random (backlog, teams) pair, in the format of main.parse_csv.
+
+    Stories depend only on previous stories, so dependencies have no cycles.
+    About 90% of the stories are in backlog status, 5% working and 5% done.
+    The teams together have time for about a third of the backlog.
+
+    @param stories: number of stories
+    @param teams: number of teams
+    @param dependency_density: mean number of dependencies of a story
+    @param seed: seed of the generator
+    """
+    generator = random.Random(seed)
+    backlog = {}
+    for story in range(stories):
+        dependencies = set()
+        if story > 0:
+            # Binomial draw with mean dependency_density
+            trials = max(1, int(2 * dependency_density))
+            for i in range(trials):
+                if generator.random() < dependency_density / trials:
+                    dependencies.add('S%d' % generator.randrange(story))
+        rand = generator.random()
+        backlog['S%d' % story] = {
+            'story_desc': 'Synthetic story %d' % story,
+            'dependency': ','.join(sorted(dependencies)),
+            'priority': round(generator.uniform(0.1, 1), 2),
+            'time': float(generator.choice(STORY_TIMES)),
+            'status': 'backlog' if rand < 0.9 else 'working' if rand < 0.95 else 'done'}
+
+    total_time = sum(story['time'] for story in backlog.values())
+    team_specs = {}
+    for team in range(teams):
+        team_specs['t%d' % team] = {
+            'efficiency': round(generator.uniform(0.3, 1), 2),
+            'cost': float(generator.randrange(20, 101)),
+            'available_time': float(round(total_time / (3 * teams)))}
+
+    return backlog, team_specs
+
+
+def write_csv(file_name, data, fields):
+    """
+    Writes {id: data} to a CSV file readable by main.parse_csv.
+
+    @param file_name: the CSV file
+    @param data: {id: {field: value}}
+    @param fields: the columns after the id
+    """
+    with open(file_name, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.writer(csvfile, delimiter=',', quotechar='"')
+        writer.writerow(['id'] + fields)
+        for key, value in data.items():
+            writer.writerow([key] + [value[field] for field in fields])
+
+
+def ga(args):
+    """
+    Runs ga_run for every backlog size, reproduction_type and
+    selection_strategy, each on a new interpreter so peak memory is measured
+    per case.
+
+    @param args: the command line arguments
+    """
+    report = []
+    for stories in args.stories:
+        for reproduction_type in REPRODUCTION_TYPES:
+            for selection_strategy in SELECTION_STRATEGIES:
+                command = [sys.executable, __file__, 'ga-run', '--stories', str(stories), \
+                    '--teams', str(args.teams), '--dependency-density', \
+                    str(args.dependency_density), '--population', str(args.population), \
+                    '--generations', str(args.generations), '--genome', args.genome, \
+                    '--seed', str(args.seed), '--reproduction-type', reproduction_type, \
+                    '--selection-strategy', selection_strategy]
+                case = json.loads(subprocess.run(command, check=True, \
+                    stdout=subprocess.PIPE).stdout)
+                print(json.dumps(case), file=sys.stderr)
+                report.append(case)
+
+    return report
+
+
+def ga_run(args):
+    """
+    Measures one configuration of the algorithm on a synthetic backlog.
+
+    @param args: the command line arguments
+    """
+    from story_selector import StorySelector
+
+    backlog, teams = synthetic_backlog(args.stories, args.teams, args.dependency_density, \
+        args.seed)
+    config = {
+        'population_size': args.population,
+        'reproduction_type': args.reproduction_type,
+        'reproduction_tournament_size': 3,
+        'mutation_probability': 0.5,
+        'selection_strategy': args.selection_strategy,
+        'genome': args.genome
+    }
+    start = time.perf_counter()
+    story_selector = StorySelector(config, backlog, teams, 'benchmark', seed=args.seed)
+    story_selector.generate_population()
+    initialized = time.perf_counter()
+    initial_evaluations = story_selector.fitness_evaluations
+    fitness = story_selector.evolve(args.generations)
+    end = time.perf_counter()
+
+    return {'stories': args.stories, 'reproduction_type': args.reproduction_type, \
+        'selection_strategy': args.selection_strategy, 'genome': args.genome, \
+        'initialization': initialized - start, \
+        'generations_per_second': len(fitness) / (end - initialized), \
+        'evaluations_per_second': (story_selector.fitness_evaluations \
+            - initial_evaluations) / (end - initialized), \
+        'peak_memory_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / MAXRSS_PER_MB, \
+        'final_fitness': fitness[-1][0]}
+
+
+def parse_args():
+    """
+    Parse command line arguments and print help text
+    """
+    parser = argparse.ArgumentParser(description=__doc__, \
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    benchmarks = parser.add_subparsers(dest='benchmark', required=True)
+
+    for name in ['startup', 'startup-run']:
+        startup_parser = benchmarks.add_parser(name)
+        startup_parser.add_argument('backlog', nargs='?', default='data/IoT_backlog.csv', \
+            help='backlog in CSV')
+        startup_parser.add_argument('teams', nargs='?', default='data/teams.csv', \
+            help='team specifications in CSV')
+        startup_parser.add_argument('--repeat', type=int, default=10, \
+            help='number of measured processes')
+
+    generate_parser = benchmarks.add_parser('generate')
+    generate_parser.add_argument('backlog', help='backlog CSV to write')
+    generate_parser.add_argument('teams_file', help='team specifications CSV to write')
+    add_synthetic_args(generate_parser, 1000)
+
+    for name in ['ga', 'ga-run']:
+        ga_parser = benchmarks.add_parser(name)
+        add_synthetic_args(ga_parser, [1000, 10000, 100000] if name == 'ga' else 1000)
+        ga_parser.add_argument('--population', type=int, default=100)
+        ga_parser.add_argument('--generations', type=int, default=10)
+        ga_parser.add_argument('--genome', choices=['list', 'array'], default='array')
+        if name == 'ga-run':
+            ga_parser.add_argument('--reproduction-type', choices=REPRODUCTION_TYPES)
+            ga_parser.add_argument('--selection-strategy', choices=SELECTION_STRATEGIES)
+
+    return parser.parse_args()
+
+
+def add_synthetic_args(parser, stories):
+    """
+    Adds the options of the synthetic backlog to @param parser.
+
+    @param stories: default number of stories, a list when several sizes are accepted
+    """
+    if isinstance(stories, list):
+        parser.add_argument('--stories', type=int, nargs='+', default=stories, \
+            help='number of stories of the backlog')
+    else:
+        parser.add_argument('--stories', type=int, default=stories, \
+            help='number of stories of the backlog')
+    parser.add_argument('--teams', type=int, default=3, help='number of teams')
+    parser.add_argument('--dependency-density', type=float, default=1.0, \
+        help='mean number of dependencies of a story')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic backlog')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
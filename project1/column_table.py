@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+#
+# Copyright 2016 (C) Thiago Pinto.
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+"""
+Columnar storage of the backlog and teams files.
+
+A table is loaded from CSV in one pass into typed NumPy columns and can be
+saved to a directory of .npy files, which is memory-mapped when loaded back.
+cached_table keeps such a directory per source file in a cache directory.
+
+    ./column_table.py <backlog.csv|teams.csv> <directory>
+"""
+__author__ = "Thiago Pinto"
+
+import os
+import gc
+import sys
+import csv
+import json
+import shutil
+import hashlib
+import itertools
+import contextlib
+import numpy as np
+
+# Columns converted to float, the other ones are kept as text
+NUMBER_FIELDS = ['efficiency', 'cost', 'available_time', 'priority', 'time']
+
+# Version of the table format, cached tables of other versions are rebuilt
+TABLE_VERSION = 1
+
+
+class ColumnTable:
+    """
+    Rows of a CSV file stored by column.
+
+    The first CSV column is the row id. The other columns are stored as:
+        - NUMBER_FIELDS: float64 arrays
+        - status: integer codes into the status_names array
+        - dependency: CSR lists of row indexes, the dependencies of row r are
+          dependency_indices[dependency_indptr[r]:dependency_indptr[r + 1]]
+        - anything else: unicode arrays
+
+    Tables are read-only: loaded tables may be memory-mapped.
+    """
+
+    def __init__(self, ids, columns):
+        """
+        @param ids: unicode array with the id of each row
+        @param columns: {name: array}, in the format above
+        """
+        self.ids = ids
+        self.columns = columns
+
+
+    @classmethod
+    def read_csv(cls, file_name):
+        """
+        Reads a CSV file with a header line, see main.parse_csv.
+
+        The rows are transposed to columns by the csv module and each column
+        is converted at once, no per row objects are kept. As in parse_csv, a
+        repeated id keeps the position of its first row and the values of the
+        last one. Empty lines are skipped, a row with another number of fields
+        than the header raises ValueError.
+
+        @param file_name: the name of the file to be read and parsed
+        """
+        with open(file_name, encoding='utf-8', newline='') as csvfile, gc_paused():
+            reader = csv.reader(csvfile, delimiter=',', quotechar='"')
+            header = next(reader)
+            fields = list(zip(*checked_rows(reader, len(header), file_name))) \
+                or [()] * len(header)
+
+            # Last row of each id, in the order of the first rows
+            rows = list(dict(zip(fields[0], range(len(fields[0])))).values())
+            if len(rows) < len(fields[0]):
+                fields = [[values[row] for row in rows] for values in fields]
+
+            return cls.from_columns(np.array(fields[0], dtype=str), header[1:], fields[1:])
+
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Converts the {id: {field: value}} format of main.parse_csv to a table.
+
+        @param data: the parsed rows
+        """
+        header = list(next(iter(data.values()), {}))
+        with gc_paused():
+            fields = list(zip(*[[row[name] for name in header] for row in data.values()])) \
+                or [()] * len(header)
+
+            return cls.from_columns(np.array(list(data), dtype=str), header, fields)
+
+
+    @classmethod
+    def from_columns(cls, ids, header, fields):
+        """
+        Converts each column of values to its typed storage, see ColumnTable.
+
+        @param ids: unicode array with the id of each row
+        @param header: the names of the columns after the id
+        @param fields: the values of each column after the id
+        """
+        columns = {}
+        for name, values in zip(header, fields):
+            if name in NUMBER_FIELDS:
+                columns[name] = np.array(values, dtype=float)
+            elif name == 'status':
+                columns['status_names'], codes = np.unique(np.array(values, dtype=str), \
+                    return_inverse=True)
+                columns['status'] = codes.astype(np.min_scalar_type(len(columns['status_names'])))
+            elif name == 'dependency':
+                columns.update(dependency_columns(ids, values))
+            else:
+                columns[name] = np.array(values, dtype=str)
+
+        return cls(ids, columns)
+
+
+    def __len__(self):
+        return len(self.ids)
+
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+
+    def __contains__(self, name):
+        return name in self.columns
+
+
+    def status_is(self, *statuses):
+        """
+        Returns the mask of the rows having any of the given statuses.
+
+        @param statuses: status names
+        """
+        codes = np.flatnonzero(np.isin(self.columns['status_names'], statuses))
+        return np.isin(self.columns['status'], codes)
+
+
+    def dependencies(self, row):
+        """
+        Returns the row indexes of the dependencies of @param row.
+        """
+        indptr = self.columns['dependency_indptr']
+        return self.columns['dependency_indices'][indptr[row]:indptr[row + 1]]
+
+
+    def to_dict(self):
+        """
+        Returns the rows in the {id: {field: value}} format of main.parse_csv.
+        """
+        fields = {}
+        for name, column in self.columns.items():
+            if name == 'status':
+                fields[name] = self.columns['status_names'][column].tolist()
+            elif name == 'dependency_indptr':
+                ids = self.ids.tolist()
+                fields['dependency'] = [','.join(ids[dependency] \
+                    for dependency in self.dependencies(row)) for row in range(len(self))]
+            elif name not in ('status_names', 'dependency_indices'):
+                fields[name] = column.tolist()
+
+        return {row_id: dict(zip(fields, values)) \
+            for row_id, values in zip(self.ids.tolist(), zip(*fields.values()))}
+
+
+    def with_rows(self, rows):
+        """
+        Returns a new table with @param rows changed: the fields given for an
+        existing id replace its values, a new id is appended and must have
+        every field. The columns of the table are not modified, only the
+        changed rows are converted.
+
+        @param rows: {id: {field: value}}, in the format of main.parse_csv
+        """
+        ids = self.ids.tolist()
+        row_index = dict(zip(ids, range(len(ids))))
+        new_ids = [row_id for row_id in rows if row_id not in row_index]
+        row_index.update(zip(new_ids, itertools.count(len(ids))))
+        table_ids = np.concatenate((self.ids, np.array(new_ids, dtype=str)))
+        names = [name for name in self.columns if name not in ('status_names', \
+            'dependency_indices', 'dependency_indptr')]
+        if 'dependency_indptr' in self.columns:
+            names.append('dependency')
+        for row_id in new_ids:
+            missing = [name for name in names if name not in rows[row_id]]
+            if missing:
+                raise ValueError('Missing fields of %s: %s' % (row_id, ', '.join(missing)))
+
+        columns = dict(self.columns)
+        for name in names:
+            changed = {row_index[row_id]: row[name] for row_id, row in rows.items() if name in row}
+            if not changed:
+                continue
+            positions = np.array(list(changed), dtype=np.intp)
+            values = list(changed.values())
+            if name == 'dependency':
+                columns.update(self.changed_dependencies(row_index, positions, values))
+                continue
+            if name == 'status':
+                column = self.columns['status_names'][self.columns['status']]
+            else:
+                column = np.asarray(self.columns[name])
+            if name in NUMBER_FIELDS:
+                values = np.array(values, dtype=float)
+            else:
+                values = np.array(values, dtype=str)
+            # Text columns are widened to the longest new value
+            column = np.concatenate((column, np.zeros(len(new_ids), \
+                dtype=column.dtype))).astype(np.result_type(column, values))
+            column[positions] = values
+            if name == 'status':
+                columns['status_names'], codes = np.unique(column, return_inverse=True)
+                column = codes.astype(np.min_scalar_type(len(columns['status_names'])))
+            columns[name] = column
+
+        return ColumnTable(table_ids, columns)
+
+
+    def changed_dependencies(self, row_index, positions, values):
+        """
+        Returns the dependency columns of with_rows: the CSR lists of the
+        table with the dependencies of the rows at @param positions replaced.
+
+        @param row_index: {id: row index} of the new table
+        @param positions: indexes of the changed rows
+        @param values: comma separated dependency ids of each changed row
+        """
+        indptr = self.columns['dependency_indptr']
+        source = np.repeat(np.arange(len(self)), np.diff(indptr))
+        kept = ~np.isin(source, positions)
+        counts, changed = dependency_rows(row_index, values)
+        changed_source = np.repeat(positions, counts)
+
+        # Stable sort by row: the kept lists are already in order and each
+        # changed row keeps the order of its values
+        source = np.concatenate((source[kept], changed_source))
+        order = np.argsort(source, kind='stable')
+        indices = np.concatenate((np.asarray(self.columns['dependency_indices'])[kept], \
+            changed))[order]
+        indptr = np.zeros(len(row_index) + 1, dtype=np.intp)
+        np.cumsum(np.bincount(source, minlength=len(row_index)), out=indptr[1:])
+
+        return {'dependency_indptr': indptr, 'dependency_indices': indices}
+
+
+    def save(self, directory):
+        """
+        Saves the table as one .npy file per column.
+
+        @param directory: the directory, created if needed
+        """
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, 'ids.npy'), self.ids)
+        for name, column in self.columns.items():
+            np.save(os.path.join(directory, name + '.npy'), column)
+
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """
+        Loads a table written by save.
+
+        @param directory: the directory of the table
+        @param mmap: memory-map the columns instead of reading them
+        """
+        mmap_mode = 'r' if mmap else None
+        ids = np.load(os.path.join(directory, 'ids.npy'), mmap_mode=mmap_mode)
+        columns = {}
+        for file_name in sorted(os.listdir(directory)):
+            name, extension = os.path.splitext(file_name)
+            if extension == '.npy' and name != 'ids':
+                columns[name] = np.load(os.path.join(directory, file_name), mmap_mode=mmap_mode)
+
+        return cls(ids, columns)
+
+
+def checked_rows(reader, width, file_name):
+    """
+    Yields the non empty rows of a csv.reader, raising ValueError on a row
+    that does not have @param width fields (zip would silently truncate every
+    column to the shortest row).
+
+    @param reader: the csv.reader, after the header
+    @param width: number of fields of the header
+    @param file_name: the file, for the error message
+    """
+    for row in reader:
+        if not row:
+            continue
+        if len(row) != width:
+            raise ValueError('%s line %d: %d fields, expected %d' \
+                % (file_name, reader.line_num, len(row), width))
+        yield row
+
+
+@contextlib.contextmanager
+def gc_paused():
+    """
+    Disables the garbage collector while loading a table.
+
+    Parsing allocates millions of tuples and strings without reference
+    cycles, each allocation burst would trigger a collection that walks all
+    of them again.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def cached_table(file_name, cache_dir):
+    """
+    Returns the table of a CSV file, memory-mapped from @param cache_dir when
+    the file was already parsed.
+
+    The cache entry of a file records its size, modification time and
+    SHA-256. When size and time match the table is used without reading the
+    file; when only the time changed the file is hashed and the table is
+    reused if the content is the same. Otherwise the file is parsed again and
+    the entry replaced.
+
+    @param file_name: the CSV file
+    @param cache_dir: the cache directory, created if needed
+    """
+    source = os.path.abspath(file_name)
+    stat = os.stat(source)
+    name = '%s.%s' % (os.path.basename(source), \
+        hashlib.sha1(source.encode('utf-8')).hexdigest()[:12])
+    entry_file = os.path.join(cache_dir, name + '.json')
+
+    previous = None
+    if os.path.exists(entry_file):
+        with open(entry_file) as jfile:
+            previous = json.load(jfile)
+    entry = previous
+    if entry is not None and (entry.get('version') != TABLE_VERSION \
+        or entry['size'] != stat.st_size \
+        or not os.path.isdir(os.path.join(cache_dir, entry['table']))):
+        entry = None
+
+    if entry is not None and entry['mtime_ns'] == stat.st_mtime_ns:
+        return ColumnTable.load(os.path.join(cache_dir, entry['table']))
+
+    digest = file_hash(source)
+    if entry is None or entry['sha256'] != digest:
+        os.makedirs(cache_dir, exist_ok=True)
+        table = ColumnTable.read_csv(source)
+        table_dir = '%s.%s' % (name, digest[:16])
+        # Written aside and renamed, readers never see a partial table
+        temporary_dir = os.path.join(cache_dir, table_dir + '.tmp')
+        shutil.rmtree(temporary_dir, ignore_errors=True)
+        table.save(temporary_dir)
+        shutil.rmtree(os.path.join(cache_dir, table_dir), ignore_errors=True)
+        os.rename(temporary_dir, os.path.join(cache_dir, table_dir))
+        if previous is not None and previous.get('table') != table_dir:
+            shutil.rmtree(os.path.join(cache_dir, previous['table']), ignore_errors=True)
+    else:
+        table_dir = entry['table']
+
+    with open(entry_file + '.tmp', 'w') as jfile:
+        json.dump({'version': TABLE_VERSION, 'source': source, 'size': stat.st_size, \
+            'mtime_ns': stat.st_mtime_ns, 'sha256': digest, 'table': table_dir}, jfile)
+    os.replace(entry_file + '.tmp', entry_file)
+
+    return ColumnTable.load(os.path.join(cache_dir, table_dir))
+
+
+def file_hash(file_name):
+    """
+    Returns the SHA-256 hex digest of the content of @param file_name.
+    """
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as hfile:
+        for block in iter(lambda: hfile.read(1 << 20), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def dependency_columns(ids, values):
+    """
+    Parses the comma separated dependency ids of each row to CSR row indexes.
+
+    @param ids: unicode array with the id of each row
+    @param values: the dependency text of each row
+    """
+    counts, indices = dependency_rows(dict(zip(ids.tolist(), range(len(ids)))), values)
+    indptr = np.zeros(len(ids) + 1, dtype=np.intp)
+    np.cumsum(counts, out=indptr[1:])
+
+    return {'dependency_indptr': indptr, 'dependency_indices': indices}
+
+
+def dependency_rows(row_index, values):
+    """
+    Returns the number of dependencies of each row and their row indexes,
+    all the rows concatenated. Empty ids ("A1," or ",A1") are skipped, as the
+    original parser did.
+
+    @param row_index: {id: row index}
+    @param values: the comma separated dependency ids of each row
+    """
+    dependencies = [list(filter(None, value.split(','))) for value in values]
+    try:
+        indices = np.array(list(map(row_index.__getitem__, \
+            itertools.chain.from_iterable(dependencies))), dtype=np.intp)
+    except KeyError as error:
+        raise ValueError('Unknown dependency: %s' % error.args[0])
+
+    return [len(row) for row in dependencies], indices
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print("Expected arguments: ./column_table.py <backlog.csv|teams.csv> <directory>")
+        exit(-1)
+    ColumnTable.read_csv(sys.argv[1]).save(sys.argv[2])
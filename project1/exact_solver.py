@@ -0,0 +1,226 @@
+# Copyright 2016 (C) Thiago Pinto.
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+__author__ = "Thiago Pinto"
+
+import time
+import numpy as np
+from story_selector import StorySelector
+
+# Default largest number of backlog stories solved exactly
+EXACT_MAX_STORIES = 40
+
+# Default number of search nodes before falling back to the genetic algorithm
+EXACT_MAX_NODES = 1 << 20
+
+
+class NodeBudgetExceeded(Exception):
+    pass
+
+
+class ExactSolver:
+    """
+    Exact solver for small backlogs.
+
+    Depth-first branch and bound over the (story -> team slot or none) space,
+    maximizing the same expression as StorySelector.fitness_points:
+
+        fitness = SP / (1 + (C / SP) * 4 * I * E) = SP^2 / (SP + 4 * C * I * E)
+
+    for the story points SP, cost C, invalid dependencies I and excess hours E
+    of a solution. While stories are assigned C, I and E never decrease and SP
+    is at most the points assigned plus the points still undecided. The
+    completions of a partial solution are bounded in three groups:
+        - I = 0: fitness SP. The starting solution (see incumbent) already
+          has the most story points possible without invalid dependencies
+        - E = 0: fitness SP, at most the points that fit in the free hours
+        - I >= 1 and E > 0: E is at least the hours of SP points at the best
+          team efficiency minus the available time of all the teams
+    """
+
+    def __init__(self, config, backlog, teams, config_name, index=None):
+        """
+        @param config: algorithm configuration parameters
+        @param backlog: the project stories, {story_id: data} or ColumnTable
+        @param teams: the teams, {team_id: data} or ColumnTable
+        @param config_name: name of the configuration
+        @param index: BacklogIndex built beforehand, see StorySelector
+        """
+        self.config = config
+        self.config_name = config_name
+        # Genomes and their vectorized fitness come from the array genome
+        self.story_selector = StorySelector(dict(config, genome='array'), backlog, teams, \
+            config_name, seed=0, index=index)
+        self.index = self.story_selector.index
+
+
+    def run(self):
+        """
+        Returns the optimum in the format of StorySelector.run, or None when
+        the instance is too large: more than exact_max_stories backlog
+        stories, or more than exact_max_nodes search nodes.
+
+        @config exact_max_stories: defaults to EXACT_MAX_STORIES
+        @config exact_max_nodes: defaults to EXACT_MAX_NODES
+        """
+        print('-----------Init--------------')
+        print(self.config)
+
+        start_time = time.monotonic()
+        if len(self.index.backlog_stories) > self.config.get('exact_max_stories', \
+            EXACT_MAX_STORIES):
+            print('Too many stories for the exact solver')
+            return None
+        try:
+            genome, nodes = self.solve(self.config.get('exact_max_nodes', EXACT_MAX_NODES))
+        except NodeBudgetExceeded:
+            print('Exact solver node budget exceeded')
+            return None
+
+        best = float(self.story_selector.genomes_fitness(genome[None])[0])
+        solution = self.index.decode(genome)
+        print(best)
+        print(solution)
+
+        return {'fitness_points': best, 'solution': solution, 'history': [], \
+            'generations': 0, 'stop_cause': 'exact', 'nodes': nodes, \
+            'time': time.monotonic() - start_time}
+
+
+    def solve(self, max_nodes):
+        """
+        Returns the optimal genome and the number of search nodes visited.
+
+        Stories are decided by decreasing story points, so the bound tightens
+        early. Each dependency edge is checked at the depth where both of its
+        stories are decided.
+
+        @param max_nodes: raise NodeBudgetExceeded after this number of nodes
+        """
+        index = self.index
+        order = index.backlog_stories[np.argsort(-index.story_time[index.backlog_stories], \
+            kind='stable')].tolist()
+        depth_of = {story: depth for depth, story in enumerate(order)}
+        slots = index.team_slots
+        teams = len(index.team_ids)
+        story_time = [float(index.story_time[story]) for story in order]
+        story_hours = [index.story_hours[story].tolist() for story in order]
+        story_cost = [index.story_cost[story].tolist() for story in order]
+        available = index.slot_available_time.tolist()
+        capacity = sum(available)
+        max_efficiency = float(index.team_efficiency.max())
+
+        # Edges of stories out of the backlog never count, edges to stories out
+        # of the backlog are checked as soon as their source is decided
+        edges = [[] for story in order]
+        for source, target, working in zip(index.dependency_source.tolist(), \
+            index.dependency_target.tolist(), index.dependency_working.tolist()):
+            if source in depth_of:
+                edges[max(depth_of[source], depth_of.get(target, -1))].append( \
+                    (source, target, working))
+
+        def invalid(source_slot, target_slot, working):
+            # Python version of StorySelector.invalid_dependencies
+            if source_slot < 0:
+                return False
+            if index.sprints == 1:
+                return working or target_slot != source_slot
+            sprint = source_slot // teams
+            if working:
+                return sprint == 0
+            return not (target_slot == source_slot \
+                or (target_slot >= 0 and target_slot // teams < sprint))
+
+        genome = [-1] * len(index.story_ids)
+        hours = [0.0] * slots
+        incumbent = self.incumbent()
+        best = [float(self.story_selector.genomes_fitness(incumbent[None])[0]), incumbent]
+        nodes = [0]
+
+        def search(depth, story_points, cost, invalid_count, remaining):
+            nodes[0] += 1
+            if nodes[0] > max_nodes:
+                raise NodeBudgetExceeded()
+            excess = sum(max(0.0, used - time) for used, time in zip(hours, available))
+            points = story_points + remaining
+            if points <= best[0]:
+                return
+            bound = 0.0
+            if excess == 0:
+                free = sum(max(0.0, time - used) for used, time in zip(hours, available))
+                bound = story_points + min(remaining, free * max_efficiency)
+            # Fitness with at least one invalid dependency, at the ends of the
+            # [story_points, points] range (see bound)
+            least_excess = max_efficiency * (capacity + excess)
+            for candidate in (min(max(least_excess, story_points), points), points):
+                if candidate > 0:
+                    candidate_excess = max(excess, candidate / max_efficiency - capacity)
+                    bound = max(bound, candidate * candidate / (candidate \
+                        + 4 * cost * max(invalid_count, 1) * candidate_excess))
+            if bound <= best[0]:
+                return
+            if depth == len(order):
+                best[0] = story_points / (1 + cost / story_points * 4 * invalid_count * excess)
+                best[1] = np.array(genome, dtype=index.genome_dtype)
+                return
+
+            story = order[depth]
+            for slot in list(range(slots)) + [-1]:
+                genome[story] = slot
+                added = invalid_count + sum(invalid(genome[source], \
+                    genome[target] if target in depth_of else -1, working) \
+                    for source, target, working in edges[depth])
+                if slot >= 0:
+                    hours[slot] += story_hours[depth][slot]
+                    search(depth + 1, story_points + story_time[depth], \
+                        cost + story_cost[depth][slot], added, remaining - story_time[depth])
+                    hours[slot] -= story_hours[depth][slot]
+                else:
+                    search(depth + 1, story_points, cost, added, remaining - story_time[depth])
+            genome[story] = -1
+
+        search(0, 0.0, 0.0, 0, sum(story_time))
+
+        return best[1], nodes[0]
+
+
+    def incumbent(self):
+        """
+        Returns the best of two solutions without fitness penalty, the
+        starting bound of the search:
+            - without invalid dependencies, the most story points possible: the
+              stories whose dependencies can all be selected, in a single team
+              slot. With several sprints every story goes to the second sprint,
+              where dependencies being worked on are met
+            - without excess hours: the stories packed by decreasing story
+              points on the team slot with the most free time that fits them
+        """
+        index = self.index
+        genomes = index.empty_genomes(2)
+
+        # Stories whose dependencies cannot be met in the first sprint
+        blocked = np.zeros(len(index.story_ids), dtype=bool)
+        blocked[index.dependency_source[index.dependency_working]] = True
+        blocked[np.setdiff1d(np.arange(len(index.story_ids)), index.backlog_stories)] = True
+        changed = True
+        while changed:
+            spread = blocked[index.dependency_target] & ~blocked[index.dependency_source]
+            blocked[index.dependency_source[spread]] = True
+            changed = spread.any()
+        # A single slot keeps every dependency between selected stories valid
+        if index.sprints > 1:
+            genomes[0, index.backlog_stories] = len(index.team_ids)
+        else:
+            genomes[0, ~blocked] = 0
+
+        free = index.slot_available_time.copy()
+        for story in index.backlog_stories[np.argsort(-index.story_time[index.backlog_stories], \
+            kind='stable')]:
+            slot = int(np.argmax(free - index.story_hours[story, :-1]))
+            if index.story_hours[story, slot] <= free[slot]:
+                genomes[1, story] = slot
+                free[slot] -= index.story_hours[story, slot]
+
+        return genomes[np.argmax(self.story_selector.genomes_fitness(genomes))]
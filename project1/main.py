@@ -11,32 +11,139 @@ teams otimizing the project's cost and aggregated value.
 """
 __author__ = "Thiago Pinto"
 
+import os
 import sys
 import csv
 import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 from story_selector import StorySelector
+from exact_solver import ExactSolver
+from column_table import ColumnTable, NUMBER_FIELDS, cached_table
+
+# Backlog and teams shared read-only by the worker processes
+_worker_data = {}
 
 def main():
     """
     Import scrum data, algorithm configuration and execute algorithm.
 
     Input:
-        @arg backlog: backlog in CSV
-        @arg team_specs: team specifications in CSV
+        @arg backlog: backlog in CSV, or a directory written by ColumnTable.save
+        @arg team_specs: team specifications in CSV, or a ColumnTable directory
         @arg configs: algorithm configurations
+        @arg --workers: number of processes running configurations in parallel
+        @arg --seed: seed of the random streams, each configuration gets its own
+        @arg --output: JSON file to write the results to
+        @arg --metrics-dir: directory receiving the per generation metrics of
+        each configuration (<config_name>.jsonl)
+        @arg --no-plot: do not plot (nor import matplotlib) at the end of the runs
+        @arg --checkpoint-dir: directory receiving the periodic checkpoints of
+        each configuration (<config_name>.npz)
+        @arg --resume: checkpoint of a run to resume, replaces configs
+        @arg --cache-dir: directory keeping the parsed backlog and teams, see
+        column_table.cached_table
 
     Output:
+        {config_name: {fitness_points, solution, history}} written to --output
+    """
+
+    args = parse_args()
+    backlog = load_table(args.backlog, args.cache_dir)
+    teams = load_table(args.team_specs, args.cache_dir)
+    if args.resume:
+        config_name, config = StorySelector.checkpoint_config(args.resume)
+        configs = {config_name: config}
+    else:
+        configs = parse_json(args.configs)
+    if args.no_plot:
+        for name in configs:
+            configs[name]['plot'] = False
+    if args.metrics_dir:
+        os.makedirs(args.metrics_dir, exist_ok=True)
+        for name in configs:
+            configs[name].setdefault('metrics_file', \
+                os.path.join(args.metrics_dir, name + '.jsonl'))
+    if args.checkpoint_dir:
+        os.makedirs(args.checkpoint_dir, exist_ok=True)
+        for name in configs:
+            configs[name].setdefault('checkpoint_file', \
+                os.path.join(args.checkpoint_dir, name + '.npz'))
+
+    # One independent random stream per configuration, the same whatever the
+    # number of workers
+    seeds = dict(zip(configs, np.random.SeedSequence(args.seed).spawn(len(configs))))
+
+    if args.resume:
+        results = {config_name: run_configuration(config_name, configs[config_name], \
+            backlog, teams, seeds[config_name], args.resume)}
+    elif args.workers > 1:
+        results = run_parallel(configs, backlog, teams, seeds, args.workers)
+    else:
+        results = {config: run_configuration(config, configs[config], backlog, teams, \
+            seeds[config]) for config in configs}
+
+    if args.output:
+        with open(args.output, 'w') as jfile:
+            json.dump(results, jfile, indent=2)
+
+
+def run_configuration(config_name, config, backlog, teams, seed, checkpoint=None, index=None):
+    """
+    Runs the algorithm for one configuration with its own random generator.
+
+    Configurations with solver 'exact' are first given to ExactSolver, the
+    genetic algorithm only runs when the instance is too large for it.
+
+    @param config_name: name of the configuration
+    @param config: algorithm configuration parameters
+    @param seed: SeedSequence of the configuration random stream
+    @param checkpoint: checkpoint file to resume the run from, its random
+    state replaces the seed
+    @param index: BacklogIndex of the backlog and teams built beforehand
+    """
+    if config.get('solver') == 'exact' and checkpoint is None:
+        result = ExactSolver(config, backlog, teams, config_name, index=index).run()
+        if result is not None:
+            return result
+
+    story_selector = StorySelector(config, backlog, teams, config_name, seed=seed, index=index)
+    return story_selector.run(checkpoint)
+
 
+def run_parallel(configs, backlog, teams, seeds, workers):
     """
+    Runs the configurations on a pool of @param workers processes.
 
-    check_args()
-    backlog = parse_csv(sys.argv[1])
-    teams = parse_csv(sys.argv[2])
-    configs = parse_json(sys.argv[3])
+    The backlog and teams are sent once to each worker instead of with every
+    configuration. Results are returned in the order of configs.
 
-    for config in configs:
-        story_selector = StorySelector(configs[config], backlog, teams, config)
-        story_selector.run();
+    @param configs: {config_name: algorithm configuration parameters}
+    @param seeds: {config_name: SeedSequence}
+    @param workers: number of processes
+    """
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, \
+        initargs=(backlog, teams)) as executor:
+        futures = {config: executor.submit(run_worker, config, configs[config], seeds[config]) \
+            for config in configs}
+        return {config: futures[config].result() for config in configs}
+
+
+def init_worker(backlog, teams):
+    """
+    Stores the data shared by all the configurations run by a worker process.
+    """
+    _worker_data['backlog'] = backlog
+    _worker_data['teams'] = teams
+
+
+def run_worker(config_name, config, seed):
+    """
+    Runs a configuration on a worker process, see run_configuration.
+    """
+    return run_configuration(config_name, config, _worker_data['backlog'], \
+        _worker_data['teams'], seed)
 
 
 def parse_json(file_name):
@@ -49,6 +156,21 @@ def parse_json(file_name):
         return json.loads(jfile.read())
 
 
+def load_table(file_name, cache_dir=None):
+    """
+    Loads a CSV file into typed columns, or memory-maps a table saved by
+    ColumnTable.save when @param file_name is a directory.
+
+    @param file_name: the CSV file or table directory
+    @param cache_dir: directory of the parse cache, None to always parse
+    """
+    if os.path.isdir(file_name):
+        return ColumnTable.load(file_name)
+    if cache_dir is not None:
+        return cached_table(file_name, cache_dir)
+    return ColumnTable.read_csv(file_name)
+
+
 def parse_csv(file_name):
     """
     Parses the CSV file ignoring the header and returns a dictionary {id: data}.
@@ -71,25 +193,49 @@ def convert_numbers(parsed_data):
 
     @param parsed_data: data parsed_data from csv_file
     """
-    expected_number_filds = ['efficiency', 'cost', 'available_time', 'priority','time']
     for value in parsed_data.values():
-        for key in expected_number_filds:
+        for key in NUMBER_FIELDS:
             if key in value:
                 value[key] = float(value[key])
 
 
-def check_args():
+def parse_args():
     """
-    Check command line arguments and print help text
+    Parse command line arguments and print help text
 
     Expected call:
-        ./main.py <backlog.csv> <teams.csv> <alg_config.json>
+        ./main.py <backlog.csv> <teams.csv> <alg_config.json> [--workers N]
+            [--seed SEED] [--output results.json] [--metrics-dir DIR] [--no-plot]
+            [--checkpoint-dir DIR] [--cache-dir DIR]
+        ./main.py <backlog.csv> <teams.csv> --resume <checkpoint.npz>
 
     File format example can be seen in /data directory
     """
-    if len(sys.argv) != 4:
-        print("Expected arguments: ./main.py <backlog.csv> <teams.csv> <alg_config.json>")
-        exit(-1)
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('backlog', help='backlog in CSV or table directory')
+    parser.add_argument('team_specs', help='team specifications in CSV or table directory')
+    parser.add_argument('configs', nargs='?', help='algorithm configurations in JSON')
+    parser.add_argument('--workers', type=int, default=1, \
+        help='number of configurations run in parallel')
+    parser.add_argument('--seed', type=int, default=None, \
+        help='seed for reproducible runs')
+    parser.add_argument('--output', default=None, help='JSON file to write the results to')
+    parser.add_argument('--metrics-dir', default=None, \
+        help='directory to stream the per generation metrics to')
+    parser.add_argument('--no-plot', action='store_true', \
+        help='do not plot the fitness history of the runs')
+    parser.add_argument('--checkpoint-dir', default=None, \
+        help='directory to save the periodic checkpoints of the runs to')
+    parser.add_argument('--resume', default=None, \
+        help='checkpoint file of the run to resume')
+    parser.add_argument('--cache-dir', default=None, \
+        help='directory to cache the parsed backlog and teams in')
+
+    args = parser.parse_args()
+    if args.configs is None and args.resume is None:
+        parser.error('the algorithm configurations are required unless resuming')
+
+    return args
 
 
 if __name__ == '__main__':
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+#
+# Copyright 2016 (C) Thiago Pinto.
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+"""
+Per generation metrics of the genetic algorithm: streaming writers and the
+plot of a run, that can be rendered after the run from the metrics file.
+
+    ./metrics.py <metrics.jsonl|metrics.csv> <image.png>
+"""
+__author__ = "Thiago Pinto"
+
+import sys
+import csv
+import json
+
+# Fields of a generation record
+FIELDS = ['config', 'generation', 'best', 'worst', 'mean', 'diversity', 'hamming', 'evaluations', \
+    'time']
+
+
+class MetricsWriter:
+    """
+    Writes each generation record as soon as it is received, as JSON Lines or
+    as CSV when the file name ends with .csv. CSV columns are FIELDS plus the
+    extra fields of the first record (profile times).
+    """
+
+    def __init__(self, file_name, append=False):
+        """
+        @param file_name: the metrics file
+        @param append: append to the file instead of overwriting it
+        """
+        self.file = open(file_name, 'a' if append else 'w', newline='', encoding='utf-8')
+        self.csv = file_name.endswith('.csv')
+        self.writer = None
+
+
+    def __call__(self, record):
+        """
+        Writes a generation record.
+
+        @param record: dict with the FIELDS of a generation
+        """
+        if not self.csv:
+            self.file.write(json.dumps(record) + '\n')
+        else:
+            if self.writer is None:
+                self.writer = csv.DictWriter(self.file, extrasaction='ignore', \
+                    fieldnames=FIELDS + [key for key in record if key not in FIELDS])
+                if self.file.tell() == 0:
+                    self.writer.writeheader()
+            self.writer.writerow(record)
+        self.file.flush()
+
+
+    def close(self):
+        self.file.close()
+
+
+def read_metrics(file_name):
+    """
+    Reads the records written by MetricsWriter.
+
+    @param file_name: the metrics file
+    """
+    with open(file_name, newline='', encoding='utf-8') as mfile:
+        if file_name.endswith('.csv'):
+            return [{key: value if key == 'config' else float(value) \
+                for key, value in row.items()} for row in csv.DictReader(mfile)]
+        return [json.loads(line) for line in mfile if line.strip()]
+
+
+def plot_history(fitness, image_name):
+    """
+    Plots the best, worst and mean fitness of each generation.
+
+    matplotlib is only imported here, runs that do not plot never load it.
+
+    @param fitness: list of (best, worst, mean) fitness points
+    @param image_name: the image file
+    """
+    import matplotlib.pyplot as plt
+
+    lines = plt.plot(fitness)
+    plt.setp(lines, linewidth=2.0)
+    plt.xlabel('Iteração')
+    plt.ylabel('Fitness')
+    plt.title('Melhor, pior e fitness médio da população')
+    plt.setp(lines[0], marker='None')
+    plt.setp(lines[1], marker='None')
+    plt.setp(lines[2], marker='None')
+    plt.legend(lines, ['Melhor solução', 'Pior solução', 'Média'], loc=4)
+    plt.savefig(image_name)
+    plt.clf()
+
+
+def plot_metrics(file_name, image_name):
+    """
+    Plots a run from its metrics file.
+
+    @param file_name: the metrics file
+    @param image_name: the image file
+    """
+    plot_history([(record['best'], record['worst'], record['mean']) \
+        for record in read_metrics(file_name)], image_name)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print("Expected arguments: ./metrics.py <metrics.jsonl|metrics.csv> <image.png>")
+        exit(-1)
+    plot_metrics(sys.argv[1], sys.argv[2])
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+#
+# Copyright 2016 (C) Thiago Pinto.
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+"""
+Optimization service: loads a backlog and its teams once and runs the
+configurations it receives over HTTP on a pool of worker processes, which
+keep the backlog index of each number of sprints in memory between jobs.
+
+    ./server.py <backlog.csv> <teams.csv> [--port N | --socket PATH] [--workers N]
+
+Requests and responses are JSON:
+    POST /optimize      runs a job and returns its result
+    POST /jobs          queues a job, returns {'id', 'status'}
+    GET /jobs/<id>      {'id', 'status', 'result' or 'error'}
+    DELETE /jobs/<id>   cancels a queued job
+    GET /status         backlog size, workers and jobs by status
+
+A job is {'config': {...}, 'config_name', 'seed', 'backlog_delta'}, only the
+algorithm configuration is required. Configurations cannot set the options
+writing files on the server (FILE_OPTIONS), and are never plotted. backlog_delta is {story_id: {field:
+value}} applied to the loaded backlog for that job only (see
+ColumnTable.with_rows). The result is the one of main.run_configuration.
+"""
+__author__ = "Thiago Pinto"
+
+import os
+import sys
+import json
+import stat
+import uuid
+import argparse
+import threading
+import socketserver
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import main
+from backlog_index import BacklogIndex
+
+# Number of finished jobs whose result is kept
+FINISHED_JOBS = 1000
+
+# Options writing files on the server, rejected in job configs
+FILE_OPTIONS = ['metrics_file', 'checkpoint_file', 'checkpoint_interval']
+
+# Backlog, teams and warm indexes of the worker processes
+_worker_data = {}
+
+
+class OptimizationService:
+    """
+    Job queue of the server.
+
+    Jobs are submitted to a ProcessPoolExecutor, whose call queue is the job
+    queue. Each worker process receives the backlog and teams tables once,
+    with the index of a single sprint already built, and builds the index of
+    another number of sprints on its first job planning it.
+    """
+
+    def __init__(self, backlog, teams, workers):
+        """
+        @param backlog: the project stories ColumnTable
+        @param teams: the teams ColumnTable
+        @param workers: number of worker processes
+        """
+        self.backlog = backlog
+        self.teams = teams
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, \
+            initargs=(backlog, teams, {1: BacklogIndex(backlog, teams)}))
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+
+    def submit(self, job):
+        """
+        Queues a job and returns its id.
+
+        @param job: {'config', 'config_name', 'seed', 'backlog_delta'}
+        """
+        if not isinstance(job, dict) or not isinstance(job.get('config'), dict):
+            raise ValueError('A job needs an algorithm config')
+        backlog_delta = job.get('backlog_delta') or {}
+        if not isinstance(backlog_delta, dict):
+            raise ValueError('backlog_delta must be {story_id: {field: value}}')
+        rejected = [option for option in FILE_OPTIONS if option in job['config']]
+        if rejected:
+            raise ValueError('Options not accepted by the server: %s' % ', '.join(rejected))
+        # Results go back to the client, the service does not plot
+        config = dict(job['config'], plot=False)
+        job_id = uuid.uuid4().hex
+        future = self.executor.submit(run_job, job.get('config_name', job_id), config, \
+            np.random.SeedSequence(job.get('seed')), backlog_delta)
+        with self.lock:
+            self.jobs[job_id] = future
+            self.forget_finished()
+
+        return job_id
+
+
+    def forget_finished(self):
+        """
+        Drops the oldest finished jobs beyond FINISHED_JOBS.
+        """
+        finished = [job_id for job_id, future in self.jobs.items() if future.done()]
+        for job_id in finished[:max(0, len(finished) - FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+
+    def job(self, job_id, wait=False):
+        """
+        Returns the status of a job and its result or error once finished, or
+        None for an unknown job.
+
+        @param job_id: the id returned by submit
+        @param wait: wait until the job finishes
+        """
+        with self.lock:
+            future = self.jobs.get(job_id)
+        if future is None:
+            return None
+        if wait:
+            future.exception()
+
+        state = {'id': job_id, 'status': job_status(future)}
+        if state['status'] == 'done':
+            state['result'] = future.result()
+        elif state['status'] == 'failed':
+            state['error'] = str(future.exception())
+        return state
+
+
+    def cancel(self, job_id):
+        """
+        Cancels a job that did not start, returns if it was cancelled.
+
+        @param job_id: the id returned by submit
+        """
+        with self.lock:
+            future = self.jobs.get(job_id)
+        return future is not None and future.cancel()
+
+
+    def status(self):
+        """
+        Returns the size of the backlog, the workers and the count of jobs by status.
+        """
+        with self.lock:
+            futures = list(self.jobs.values())
+        jobs = {}
+        for future in futures:
+            status = job_status(future)
+            jobs[status] = jobs.get(status, 0) + 1
+
+        return {'stories': len(self.backlog), 'teams': len(self.teams), \
+            'workers': self.workers, 'jobs': jobs}
+
+
+    def shutdown(self):
+        self.executor.shutdown(cancel_futures=True)
+
+
+def job_status(future):
+    """
+    Returns the status of a job from its future: queued, running, done,
+    failed or cancelled.
+    """
+    if future.cancelled():
+        return 'cancelled'
+    if future.done():
+        return 'failed' if future.exception() is not None else 'done'
+    return 'running' if future.running() else 'queued'
+
+
+def init_worker(backlog, teams, indexes):
+    """
+    Stores the tables and the indexes {sprints: BacklogIndex} of a worker process.
+    """
+    _worker_data['backlog'] = backlog
+    _worker_data['teams'] = teams
+    _worker_data['indexes'] = indexes
+
+
+def run_job(config_name, config, seed, backlog_delta):
+    """
+    Runs a job on a worker process, see main.run_configuration.
+
+    Jobs without backlog_delta reuse the index of the worker, a changed
+    backlog gets its own index.
+
+    @param seed: SeedSequence of the job random stream
+    @param backlog_delta: {story_id: {field: value}} changed for this job
+    """
+    backlog = _worker_data['backlog']
+    teams = _worker_data['teams']
+    if backlog_delta:
+        backlog = backlog.with_rows(backlog_delta)
+        index = None
+    else:
+        sprints = config.get('sprints', 1)
+        if sprints not in _worker_data['indexes']:
+            _worker_data['indexes'][sprints] = BacklogIndex(backlog, teams, sprints)
+        index = _worker_data['indexes'][sprints]
+
+    return main.run_configuration(config_name, config, backlog, teams, seed, index=index)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """
+    JSON API of the service, see the module documentation.
+    """
+
+    def do_GET(self):
+        if self.path == '/status':
+            self.send_json(200, self.server.service.status())
+        elif self.path.startswith('/jobs/'):
+            state = self.server.service.job(self.path[len('/jobs/'):])
+            if state is None:
+                self.send_json(404, {'error': 'Unknown job'})
+            else:
+                self.send_json(200, state)
+        else:
+            self.send_json(404, {'error': 'Unknown path'})
+
+
+    def do_POST(self):
+        if self.path not in ('/optimize', '/jobs'):
+            self.send_json(404, {'error': 'Unknown path'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            job_id = self.server.service.submit(json.loads(self.rfile.read(length)))
+        except (ValueError, TypeError) as error:
+            # json.JSONDecodeError is a ValueError, a bad seed a TypeError
+            self.send_json(400, {'error': str(error)})
+            return
+
+        if self.path == '/optimize':
+            state = self.server.service.job(job_id, wait=True)
+            self.send_json(200 if state['status'] == 'done' else 500, state)
+        else:
+            self.send_json(202, {'id': job_id, 'status': 'queued'})
+
+
+    def do_DELETE(self):
+        if self.path.startswith('/jobs/') \
+            and self.server.service.cancel(self.path[len('/jobs/'):]):
+            self.send_json(200, {'status': 'cancelled'})
+        else:
+            self.send_json(409, {'error': 'Unknown or started job'})
+
+
+    def send_json(self, code, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else self.server.server_address
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(args):
+    """
+    Loads the backlog and teams and serves requests until interrupted.
+
+    @param args: the command line arguments
+    """
+    backlog = main.load_table(args.backlog, args.cache_dir)
+    teams = main.load_table(args.team_specs, args.cache_dir)
+    service = OptimizationService(backlog, teams, args.workers)
+
+    if args.socket:
+        # A socket left by a previous server would fail the bind
+        if os.path.exists(args.socket) and stat.S_ISSOCK(os.stat(args.socket).st_mode):
+            os.unlink(args.socket)
+        server = UnixHTTPServer(args.socket, RequestHandler)
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), RequestHandler)
+    server.service = service
+    print('Serving %d stories on %s' % (len(backlog), args.socket or \
+        '%s:%d' % server.server_address[:2]), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+        if args.socket:
+            os.unlink(args.socket)
+
+
+def parse_args():
+    """
+    Parse command line arguments and print help text
+    """
+    parser = argparse.ArgumentParser(description=__doc__, \
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('backlog', help='backlog in CSV or table directory')
+    parser.add_argument('team_specs', help='team specifications in CSV or table directory')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8906, help='TCP port to listen on')
+    parser.add_argument('--socket', default=None, \
+        help='Unix socket to listen on instead of TCP')
+    parser.add_argument('--workers', type=int, default=1, \
+        help='number of processes running jobs in parallel')
+    parser.add_argument('--cache-dir', default=None, \
+        help='directory keeping the parsed backlog and teams between runs')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    sys.exit(serve(parse_args()))
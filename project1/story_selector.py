@@ -5,9 +5,41 @@
 
 __author__ = "Thiago Pinto"
 
-import random
+import os
+import sys
+import json
+import time
+import heapq
+import bisect
+import itertools
+import multiprocessing
+from collections import OrderedDict
 from operator import itemgetter
-import matplotlib.pyplot as plt
+import numpy as np
+from backlog_index import BacklogIndex
+from column_table import ColumnTable
+from metrics import MetricsWriter, plot_history
+
+# Number of genome slots evaluated at once by genomes_aggregates
+FITNESS_BLOCK = 1 << 22
+
+# Default maximum number of generations of a run
+GENERATIONS = 100
+
+# Default number of solutions whose fitness points are memoized
+FITNESS_CACHE_SIZE = 1 << 16
+
+# Phases timed by the profile option and the methods of each one
+PROFILED_PHASES = {
+    'reproduce': ['reproduce'],
+    'crossover': ['crossover', 'crossover_genomes'],
+    'mutation': ['mutation', 'mutation_genome'],
+    'remove_duplicate_stories': ['remove_duplicate_stories'],
+    'fitness_points': ['fitness_points', 'genomes_aggregates', 'aggregates_fitness'],
+    'select': ['select'],
+    'remove_clones': ['remove_clones'],
+    'local_search': ['local_search']
+}
 
 
 class StorySelector:
@@ -20,21 +52,128 @@ class StorySelector:
         - teams implementation speed in story points per hour;
         - story dependency (with oother stories)
         - team cost (in $ per hour)
+
+    Solutions are lists of attributions {'team_id', 'story_id'} unless the
+    configuration sets genome to 'array'. In that mode the population is a
+    dict with a 2-D array 'genomes' (one row per individual, see BacklogIndex)
+    and a 'fitness_points' vector.
+
+    With sprints > 1 the genomes plan several sprints at once: each story is
+    assigned to a team slot (team, sprint), the available time is checked per
+    team and sprint and a dependency planned in an earlier sprint is met.
     """
 
-    def __init__(self, config,  backlog, teams, config_name):
+    def __init__(self, config,  backlog, teams, config_name, metrics=None, seed=None, \
+        index=None):
         """
         Initialize global data structures
 
         @param config: algorithm configuration parameters
         @param config_name: name of the configuration
-        @param backlog: the project stories
-        @param teams: the team to receive stories to implement on next sprint
+        @param backlog: the project stories, {story_id: data} or ColumnTable
+        @param teams: the team to receive stories to implement on next sprint,
+        {team_id: data} or ColumnTable
+        @param metrics: optional callback receiving the metrics record of each
+        generation (see emit_metrics)
+        @param seed: seed of the run random generator, an int or a
+        numpy.random.SeedSequence (islands get streams spawned from it). None
+        seeds from the operating system
+        @param index: BacklogIndex of the backlog and teams built beforehand,
+        used when it plans the configured number of sprints
+        @config genome: solution representation {list, array}, defaults to list
+        @config sprints: number of sprints planned, defaults to 1. More than
+        one sprint implies the array genome
+        @config fitness_cache_size: number of memoized fitness points, 0 disables
+        the cache
+        @config profile: time each phase of the generations, see enable_profiling
+        @config max_generations: must be at least 1, see stop_reason
+        @config islands: at most population_size, see run_islands
         """
+        if config.get('max_generations', GENERATIONS) < 1:
+            raise ValueError('max_generations must be at least 1')
+        if config.get('islands', 1) > 1 and config.get('population_size', 0) < config['islands']:
+            raise ValueError('population_size must be at least the number of islands')
         self.config = config
+        self.config_name = config_name
+        # Every random draw of the run comes from this generator
+        self.seed_sequence = seed if isinstance(seed, np.random.SeedSequence) \
+            else np.random.SeedSequence(seed)
+        self.rng = np.random.default_rng(self.seed_sequence)
+        sprints = self.config.get('sprints', 1)
+        if index is None or index.sprints != sprints:
+            index = BacklogIndex(backlog, teams, sprints)
+        self.index = index
+        self.array_genome = self.config.get('genome', 'list') == 'array' or sprints > 1
+        # List solutions look the stories and teams up by id, genomes only
+        # use the index
+        if not self.array_genome and isinstance(backlog, ColumnTable):
+            backlog = backlog.to_dict()
+        if not self.array_genome and isinstance(teams, ColumnTable):
+            teams = teams.to_dict()
         self.stories = backlog
         self.teams = teams
-        self.config_name = config_name
+
+        self.fitness_cache = OrderedDict()
+        self.fitness_cache_size = self.config.get('fitness_cache_size', FITNESS_CACHE_SIZE)
+        self.fitness_cache_hits = 0
+        self.fitness_cache_misses = 0
+        self.fitness_evaluations = 0
+
+        self.metrics_sinks = [metrics] if metrics is not None else []
+
+        self.profiling = bool(self.config.get('profile'))
+        if self.profiling:
+            self.enable_profiling()
+
+
+    def enable_profiling(self):
+        """
+        Wraps the methods of PROFILED_PHASES with timers. Times are inclusive:
+        crossover and mutation are also part of reproduce, fitness_points is
+        also part of the phase that asked for it.
+
+        Methods are only wrapped when profiling, unprofiled runs pay nothing.
+        """
+        self.phase_times = dict.fromkeys(PROFILED_PHASES, 0.0)
+        self.profile_totals = dict.fromkeys(PROFILED_PHASES, 0.0)
+        self.profile_totals['net_allocated_blocks'] = 0
+        for phase, methods in PROFILED_PHASES.items():
+            for name in methods:
+                setattr(self, name, self.timed(phase, getattr(self, name)))
+
+
+    def timed(self, phase, method):
+        """
+        Returns @param method adding its run time to the time of @param phase.
+        """
+        def timed_method(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.phase_times[phase] += time.perf_counter() - start
+
+        return timed_method
+
+
+    def take_profile(self, allocated_blocks):
+        """
+        Returns the time of each phase since the last call and the net change
+        of allocated memory blocks since @param allocated_blocks (blocks
+        allocated minus blocks freed, negative when memory was released), and
+        adds them to the totals of the run.
+
+        @param allocated_blocks: sys.getallocatedblocks() at the start of the
+        profiled period
+        """
+        profile = {'time_' + phase: seconds for phase, seconds in self.phase_times.items()}
+        profile['net_allocated_blocks'] = sys.getallocatedblocks() - allocated_blocks
+        for phase in self.phase_times:
+            self.profile_totals[phase] += self.phase_times[phase]
+            self.phase_times[phase] = 0.0
+        self.profile_totals['net_allocated_blocks'] += profile['net_allocated_blocks']
+
+        return profile
 
 
     def generate_population(self):
@@ -43,6 +182,10 @@ class StorySelector:
 
         @config population_size: number of random solutions to generate initially
         """
+        if self.array_genome:
+            self.population = self.generate_random_genomes(self.config['population_size'])
+            return
+
         self.population = []
 
         for i in range(0, self.config['population_size']):
@@ -55,37 +198,117 @@ class StorySelector:
         Each team will be assigned a random story until the randomly selected story
         doesn't fit in the selected team's sprint.
         """
-        solution = []
+        team_ids = list(self.teams.keys())
         available_stories = self.available_stories_id()
-        for story_id in available_stories:
-            team_id = random.choice(list(self.teams.keys()))
-
-            solution.append({'team_id': team_id, 'story_id': story_id})
+        teams = self.rng.integers(len(team_ids), size=len(available_stories)).tolist()
+        solution = [{'team_id': team_ids[team], 'story_id': story_id} \
+            for story_id, team in zip(available_stories, teams)]
 
         return {'solution': solution, 'fitness_points': self.fitness_points(solution)}
 
 
+    def generate_random_genomes(self, size):
+        """
+        Array version of generate_random_solution: every backlog story is
+        assigned to a random team slot, for @param size genomes at once.
+
+        @param size: number of genomes to generate
+        """
+        genomes = self.index.empty_genomes(size)
+        backlog_stories = self.index.backlog_stories
+        genomes[:, backlog_stories] = self.rng.integers(self.index.team_slots, \
+            size=(size, len(backlog_stories)))
+
+        return self.genomes_population(genomes)
+
+
+    def genomes_population(self, genomes):
+        """
+        Returns the population dict of @param genomes: the genomes, the
+        partial sums of their fitness expression (see genomes_aggregates),
+        their fitness points and the available stories bookkeeping.
+
+        Each individual keeps the backlog ranks (positions in
+        BacklogIndex.backlog_stories) in available_order: the first
+        available_count are the stories not in the sprint, the others are
+        assigned. available_position is the inverse permutation, so a random
+        available or assigned story is picked in O(1) and set_gene moves a
+        story between the two parts with a swap.
+
+        @param genomes: 2-D array with one genome per row
+        """
+        population = self.genomes_aggregates(genomes)
+        population['genomes'] = genomes
+        population['fitness_points'] = self.aggregates_fitness(population)
+
+        assigned = genomes[:, self.index.backlog_stories] >= 0
+        order = np.argsort(assigned, axis=1, kind='stable')
+        population['available_order'] = order.astype(self.index.rank_dtype)
+        population['available_position'] = np.argsort(order, axis=1).astype(self.index.rank_dtype)
+        population['available_count'] = np.count_nonzero(~assigned, axis=1)
+
+        return population
+
+
+    def take_genomes(self, population, rows):
+        """
+        Returns a new population with copies of the given individuals.
+
+        @param population: the population dict
+        @param rows: indexes of the individuals
+        """
+        return {key: population[key][rows] for key in population}
+
+
     def available_stories_id(self, solution=[]):
         """
         Returns the ids of the stories that have backlog status, and are not
         assined to any team on @param solution
 
+        Scans the whole backlog, O(stories) for each mutation of a list
+        solution. Array genomes keep their available stories instead, see
+        genomes_population.
+
         @param solution: the story assignmet to each team
         """
-        available_stories = []
+        assigned_stories = {attribution['story_id'] for attribution in solution}
 
-        for story_id in self.stories:
-            if self.stories[story_id]['status'] == 'backlog':
-                available_stories.append(story_id)
+        return [story_id for story_id in self.index.backlog_ids \
+            if story_id not in assigned_stories]
 
-        for attribution in solution:
-            if attribution['story_id'] in available_stories:
-                available_stories.remove(attribution['story_id'])
 
-        return available_stories
+    def fitness_points(self, solution):
+        """
+        Returns the fitness points for the given solution.
 
+        Fitness points are memoized in a LRU cache keyed by the sorted
+        (story, team) assignments of the solution, so copies of a solution are
+        never evaluated again.
 
-    def fitness_points(self, solution):
+        @param solution: a solution from a population
+        @config fitness_cache_size: maximum number of memoized solutions
+        """
+        if self.fitness_cache_size <= 0:
+            return self.evaluate_fitness_points(solution)
+
+        key = tuple(sorted((attribution['story_id'], attribution['team_id']) \
+            for attribution in solution))
+        fitness_points = self.fitness_cache.get(key)
+        if fitness_points is not None:
+            self.fitness_cache_hits += 1
+            self.fitness_cache.move_to_end(key)
+            return fitness_points
+
+        self.fitness_cache_misses += 1
+        fitness_points = self.evaluate_fitness_points(solution)
+        self.fitness_cache[key] = fitness_points
+        if len(self.fitness_cache) > self.fitness_cache_size:
+            self.fitness_cache.popitem(last=False)
+
+        return fitness_points
+
+
+    def evaluate_fitness_points(self, solution):
         """
         Calculate the fitness points for the given solution.
 
@@ -97,6 +320,7 @@ class StorySelector:
         mean cost: sum[for all stories](story points * team efficiency * team cost) / total implemented story points
         unimplemented dependencies: story that has unimplemented dependency and that dependency isn't part o the team's sprint
         """
+        self.fitness_evaluations += 1
         if(len(solution) == 0):
             return 0
 
@@ -108,19 +332,20 @@ class StorySelector:
 
         excess_hours = self.excess_hours(solution)
 
+        # Team of each story in the solution, None if assigned more than once
+        assigned_team = {}
+        for attribution in solution:
+            story_id = attribution['story_id']
+            assigned_team[story_id] = None if story_id in assigned_team else attribution['team_id']
+
         invalid_dependencies = 0
         for attribution in solution:
-            story_dependencies = self.stories[attribution['story_id']]['dependency']
-            for dependency_id in story_dependencies.split(','):
-                if dependency_id == '':
-                    continue
-                elif self.stories[dependency_id]['status'] == 'working':
+            for dependency_id in self.index.story_dependencies[attribution['story_id']]:
+                if dependency_id in self.index.working_stories:
+                    invalid_dependencies += 1
+                # See if dependency is in the team's sprint
+                elif assigned_team.get(dependency_id) != attribution['team_id']:
                     invalid_dependencies += 1
-                elif self.stories[dependency_id]['status'] == 'backlog':
-                    # See if dependency is in the team's sprint
-                    result = list(filter(lambda x: x['story_id'] == dependency_id, solution))
-                    if len(result) != 1 or result[0]['team_id'] != attribution['team_id']:
-                        invalid_dependencies += 1
 
         return total_sp / (1 + (mean_cost * 4 * invalid_dependencies * excess_hours))
 
@@ -148,6 +373,107 @@ class StorySelector:
 
         return excess_hours
 
+
+    def genomes_fitness(self, genomes):
+        """
+        Returns the vector of fitness points of the given genomes.
+
+        Same expression as fitness_points, evaluated for the whole population
+        with array operations.
+
+        @param genomes: 2-D array with one genome per row
+        """
+        return self.aggregates_fitness(self.genomes_aggregates(genomes))
+
+
+    def genomes_aggregates(self, genomes):
+        """
+        Returns the partial sums of the fitness expression of each genome:
+        story_points, cost, team_hours (one column per team slot) and
+        invalid_dependencies.
+
+        Genomes are processed in blocks of about FITNESS_BLOCK slots to bound
+        the size of the temporary arrays.
+
+        @param genomes: 2-D array with one genome per row
+        """
+        index = self.index
+        teams = index.team_slots
+        stories = np.arange(len(index.story_ids))
+        block = max(1, FITNESS_BLOCK // max(1, len(stories)))
+
+        aggregates = {'story_points': np.empty(len(genomes)), 'cost': np.empty(len(genomes)), \
+            'team_hours': np.empty((len(genomes), teams)), \
+            'invalid_dependencies': np.empty(len(genomes), dtype=np.intp)}
+        for start in range(0, len(genomes), block):
+            rows = genomes[start:start + block]
+            # -1 (not in the sprint) selects the last, all zeros, column
+            slots = np.where(rows < 0, teams, rows)
+
+            aggregates['story_points'][start:start + block] = (rows >= 0) @ index.story_time
+            aggregates['cost'][start:start + block] = index.story_cost[stories, slots].sum(axis=1)
+
+            # Per team hours: one bincount over (individual, team) pairs
+            bins = slots + (teams + 1) * np.arange(len(rows))[:, None]
+            hours = np.bincount(bins.ravel(), weights=index.story_hours[stories, slots].ravel(), \
+                minlength=len(rows) * (teams + 1))
+            aggregates['team_hours'][start:start + block] = \
+                hours.reshape(len(rows), teams + 1)[:, :teams]
+
+            invalid = self.invalid_dependencies(rows[:, index.dependency_source], \
+                rows[:, index.dependency_target], index.dependency_working)
+            aggregates['invalid_dependencies'][start:start + block] = invalid.sum(axis=1)
+
+        return aggregates
+
+
+    def aggregates_fitness(self, aggregates):
+        """
+        Returns the fitness points vector from the partial sums computed by
+        genomes_aggregates.
+
+        @param aggregates: the partial sums of the fitness expression
+        """
+        story_points = aggregates['story_points']
+        self.fitness_evaluations += len(story_points)
+        mean_cost = np.divide(aggregates['cost'], story_points, \
+            out=np.zeros(len(story_points)), where=story_points > 0)
+        excess_hours = np.clip(aggregates['team_hours'] - self.index.slot_available_time, \
+            0, None).sum(axis=1)
+
+        return story_points / (1 + mean_cost * 4 * aggregates['invalid_dependencies'] \
+            * excess_hours)
+
+    def invalid_dependencies(self, source_slot, target_slot, working):
+        """
+        Returns the mask of the invalid dependency edges.
+
+        A dependency is met when both stories are assigned to the same team.
+        When planning several sprints it is also met by a dependency assigned
+        to an earlier sprint, and a dependency being worked on is met from the
+        second sprint on.
+
+        @param source_slot: team slots of the stories that have the dependencies
+        @param target_slot: team slots of the dependencies
+        @param working: whether each dependency is being worked on
+        """
+        if self.index.sprints == 1:
+            return (source_slot >= 0) & (working | (target_slot != source_slot))
+
+        teams = len(self.index.team_ids)
+        source_sprint = source_slot // teams
+        met = np.where(working, source_sprint > 0, (target_slot == source_slot) \
+            | ((target_slot >= 0) & (target_slot // teams < source_sprint)))
+        return (source_slot >= 0) & ~met
+
+
+    def choice(self, sequence):
+        """
+        Returns a random element of @param sequence.
+        """
+        return sequence[self.rng.integers(len(sequence))]
+
+
     def mutation(self, solution):
         """
         Mutates the solution.
@@ -165,16 +491,16 @@ class StorySelector:
         if(len(available_stories) == 0):
             rand = 1
         else:
-            rand = random.random()
-            story_id = random.choice(available_stories)
-            team_id = random.choice(list(self.teams))
+            rand = self.rng.random()
+            story_id = self.choice(available_stories)
+            team_id = self.choice(list(self.teams))
         if(rand < 1/3):
             # Add new attribution
             solution.append({'team_id': team_id, 'story_id': story_id})
         elif(rand < 2/3):
             # Edit an attribuiton
-            attribution = random.choice(solution)
-            if(random.random() < 1/2):
+            attribution = self.choice(solution)
+            if(self.rng.random() < 1/2):
                 # Edit team
                 attribution['team_id'] = team_id
             else:
@@ -182,7 +508,143 @@ class StorySelector:
                 attribution['story_id'] = story_id
         else:
             # Remove an attribution
-            del solution[random.randrange(len(solution))]
+            del solution[self.rng.integers(len(solution))]
+
+
+    def set_gene(self, population, individual, story, team):
+        """
+        Assigns @param story to @param team in a genome of the population and
+        updates the partial sums of its fitness expression.
+
+        Only the dependency edges of the story are visited, so the update costs
+        O(story degree) instead of a full fitness evaluation. The fitness_points
+        of the individual are not updated, see aggregates_fitness.
+
+        @param population: the population dict
+        @param individual: the row of the genome in the population
+        @param story: the story index
+        @param team: the team slot, -1 to remove the story from the sprint
+        """
+        index = self.index
+        genome = population['genomes'][individual]
+        old_team = genome[story]
+        if old_team == team:
+            return
+
+        edges = index.story_edges(story)
+        invalid = -self.invalid_edges(genome, edges)
+        genome[story] = team
+        invalid += self.invalid_edges(genome, edges)
+        population['invalid_dependencies'][individual] += invalid
+        if (old_team < 0) != (team < 0):
+            self.move_available(population, individual, index.backlog_rank[story], team >= 0)
+
+        if old_team >= 0:
+            population['story_points'][individual] -= index.story_time[story]
+            population['cost'][individual] -= index.story_cost[story, old_team]
+            population['team_hours'][individual, old_team] -= index.story_hours[story, old_team]
+        if team >= 0:
+            population['story_points'][individual] += index.story_time[story]
+            population['cost'][individual] += index.story_cost[story, team]
+            population['team_hours'][individual, team] += index.story_hours[story, team]
+
+
+    def move_available(self, population, individual, rank, assigned):
+        """
+        Moves a story between the available and the assigned parts of the
+        available_order of an individual (see genomes_population).
+
+        @param population: the population dict
+        @param individual: the row of the genome in the population
+        @param rank: the position of the story in BacklogIndex.backlog_stories
+        @param assigned: True if the story was added to the sprint, False if removed
+        """
+        order = population['available_order'][individual]
+        position = population['available_position'][individual]
+        count = population['available_count'][individual]
+        # The story is swapped with the one at the border of the two parts
+        border = count - 1 if assigned else count
+        current = position[rank]
+        other = order[border]
+        order[current] = other
+        position[other] = current
+        order[border] = rank
+        position[rank] = border
+        population['available_count'][individual] += -1 if assigned else 1
+
+
+    def invalid_edges(self, genome, edges):
+        """
+        Returns how many of the dependency @param edges are invalid in @param genome.
+
+        @param genome: the story slot -> team slot array
+        @param edges: indexes of dependency edges
+        """
+        return int(np.count_nonzero(self.invalid_dependencies( \
+            genome[self.index.dependency_source[edges]], \
+            genome[self.index.dependency_target[edges]], self.index.dependency_working[edges])))
+
+
+    def mutation_genome(self, population, individual, draws):
+        """
+        Mutates a genome of the population in place.
+
+        Same 3 types of mutation as mutation(): add a random available story
+        to a random team, change the team or the story of an assigned slot, or
+        remove an assigned story from the sprint.
+
+        @param population: the population dict
+        @param individual: the row of the genome in the population
+        @param draws: 5 uniform random numbers in [0, 1) that choose the type
+        of mutation, the available story, the team slot, the assigned story and
+        the edited field, drawn in bulk by mutate_genomes
+        """
+        genome = population['genomes'][individual]
+        backlog_stories = self.index.backlog_stories
+        order = population['available_order'][individual]
+        available_count = population['available_count'][individual]
+        assigned_count = len(order) - available_count
+        if available_count == 0:
+            if assigned_count == 0:
+                return
+            rand = 1
+        else:
+            rand = draws[0]
+            story = backlog_stories[order[scaled(draws[1], available_count)]]
+            team = scaled(draws[2], self.index.team_slots)
+        if rand < 1/3 or assigned_count == 0:
+            # Add new attribution
+            self.set_gene(population, individual, story, team)
+        elif rand < 2/3:
+            # Edit an attribution
+            assigned = backlog_stories[order[available_count + scaled(draws[3], assigned_count)]]
+            if draws[4] < 1/2:
+                # Edit team
+                self.set_gene(population, individual, assigned, team)
+            else:
+                # Edit story
+                self.set_gene(population, individual, story, genome[assigned])
+                self.set_gene(population, individual, assigned, -1)
+        else:
+            # Remove an attribution
+            self.set_gene(population, individual, \
+                backlog_stories[order[available_count + scaled(draws[3], assigned_count)]], -1)
+
+
+    def mutate_genomes(self, population):
+        """
+        Mutates each genome of the population in place with probability
+        mutation_probability. The random numbers of all the mutations are drawn
+        at once.
+
+        @param population: the population dict
+        @config mutation_probability: the probability of a genome being mutated
+        """
+        mutation_probability = self.config['mutation_probability']
+        size = len(population['genomes'])
+        mutated = np.flatnonzero(self.rng.random(size) < mutation_probability)
+        for i, draws in zip(mutated, self.rng.random((len(mutated), 5)).tolist()):
+            self.mutation_genome(population, i, draws)
 
 
     def reproduce(self):
@@ -193,18 +655,62 @@ class StorySelector:
 
         @config reproduction_type: the type of reproduction {tournament, roulette}
         """
+        if self.array_genome:
+            self.reproduce_genomes()
+            return
+
         reproduction_type = self.config['reproduction_type']
         self.new_population = []
+        if reproduction_type == 'tournament':
+            # All the tournaments of the generation are drawn at once
+            parents = self.tournament_parents(2 * len(self.population))
+        elif reproduction_type == 'roulette':
+            # Built once per generation, see roulette_reproduction
+            cumulative_fitness = list(itertools.accumulate( \
+                map(itemgetter('fitness_points'), self.population)))
         for i in range(len(self.population)):
             if reproduction_type == 'tournament':
-                self.tournament_reproduction()
+                self.tournament_reproduction(parents[2 * i], parents[2 * i + 1])
             elif reproduction_type == 'roulette':
-                fitness_sum = sum(map(lambda x: x['fitness_points'], self.population))
-                self.roulette_reproduction(fitness_sum)
+                self.roulette_reproduction(cumulative_fitness)
             elif reproduction_type == 'none':
                 self.mutation_reproduction(self.population[i])
 
 
+    def reproduce_genomes(self):
+        """
+        Reproduces the population of genomes.
+
+        population_size new genomes are created: the selected parents are
+        copied in one block, crossed over in pairs and then mutated. The
+        children inherit the partial sums of the fitness expression of their
+        parents, which are updated gene by gene (see set_gene), so their
+        fitness is never evaluated from scratch.
+
+        @config reproduction_type: the type of reproduction {tournament, roulette, none}
+        """
+        reproduction_type = self.config['reproduction_type']
+        size = len(self.population['fitness_points'])
+        if reproduction_type == 'none':
+            children = self.take_genomes(self.population, np.arange(size))
+        else:
+            if reproduction_type == 'tournament':
+                parents = self.tournament_parents(size)
+            elif reproduction_type == 'roulette':
+                parents = self.roulette_parents(size)
+            children = self.take_genomes(self.population, parents)
+            backlog_stories = self.index.backlog_stories
+            if len(backlog_stories) > 0:
+                cutpoints = backlog_stories[self.rng.integers(len(backlog_stories), \
+                    size=size // 2)].tolist()
+                for pair, cutpoint in enumerate(cutpoints):
+                    self.crossover_genomes(children, 2 * pair, 2 * pair + 1, cutpoint)
+
+        self.mutate_genomes(children)
+        children['fitness_points'] = self.aggregates_fitness(children)
+        self.new_population = children
+
+
     def mutation_reproduction(self, solution):
         """
         Just copy and mutate individuals.
@@ -213,7 +719,7 @@ class StorySelector:
         """
         mutation_probability = self.config['mutation_probability']
         new_solution = list(solution['solution'])
-        rand = random.random()
+        rand = self.rng.random()
         if(rand < mutation_probability):
             self.mutation(new_solution)
 
@@ -222,60 +728,81 @@ class StorySelector:
 
 
 
-    def tournament_reproduction(self):
+    def tournament_reproduction(self, parentA, parentB):
         """
         Reproduction by tournament.
 
-        Two groups of reproduction_group_size solutions are selected randomly,
-        the best fit of each group is selected for reproduction.
+        Crosses over two winners of tournament_parents.
 
-        @config reproduction_tournament_size: the size o the reproduction group to find
-        the best fit
+        @param parentA, parentB: indexes of the parents in the population
         """
+        self.new_population.extend(self.crossover(self.population[parentA], \
+            self.population[parentB]))
 
-        parentA = random.choice(self.population)
-        parentB = random.choice(self.population)
-        for x in range(self.config['reproduction_tournament_size'] - 1):
-            competitorA = random.choice(self.population)
-            competitorB = random.choice(self.population)
 
-            if(parentA['fitness_points'] < competitorA['fitness_points']):
-                parentA = competitorA
-            if(parentB['fitness_points'] < competitorB['fitness_points']):
-                parentB = competitorB
+    def tournament_parents(self, size):
+        """
+        Returns the indexes of @param size individuals chosen by tournament.
 
-        self.new_population.extend(self.crossover(parentA, parentB))
+        Groups of reproduction_tournament_size individuals are selected
+        randomly, the best fit of each group is selected for reproduction. All
+        the groups are drawn as one (size x reproduction_tournament_size) matrix.
 
+        @param size: number of parents to choose
+        @config reproduction_tournament_size: the size o the reproduction group to find
+        the best fit
+        """
+        fitness = self.population_fitness()
+        groups = self.rng.integers(len(fitness), \
+            size=(size, self.config['reproduction_tournament_size']))
+
+        return groups[np.arange(size), np.argmax(fitness[groups], axis=1)]
 
-    def roulette_reproduction(self, fitness_sum):
+
+    def roulette_reproduction(self, cumulative_fitness):
         """
         Reproduction by roullete.
 
         Chooses two individuals using the following algorithm.
 
-        @algorithm: Gerenates a random number R between 0 and fitness_sum. Then
-        iterates through the population until the cumulative sum of the fitness_points
-        is more than R. The individual of the iteration that satisfies that condition
-        is the choosen one.
-        """
-
-        rA = random.randrange(int(fitness_sum))
-        rB = random.randrange(int(fitness_sum))
-
-        parentA = None
-        parentB = None
-        accumulator = 0
-        for solution in self.population:
-            accumulator += solution['fitness_points']
-            if accumulator > rA and parentA is None:
-                parentA = solution
-            if accumulator > rB and parentB is None:
-                parentB = solution
-            if parentA is not None and parentB is not None:
-                break
+        @algorithm: Gerenates a random number R in [0, fitness_sum). The choosen
+        individual is the first one whose cumulative sum of the fitness_points
+        is more than R, found by binary search on @param cumulative_fitness.
+
+        @param cumulative_fitness: prefix sums of the population fitness_points
+        """
+        fitness_sum = cumulative_fitness[-1]
+        if fitness_sum > 0:
+            parentA = self.population[bisect.bisect_right(cumulative_fitness, \
+                self.rng.uniform(0, fitness_sum), hi=len(self.population) - 1)]
+            parentB = self.population[bisect.bisect_right(cumulative_fitness, \
+                self.rng.uniform(0, fitness_sum), hi=len(self.population) - 1)]
+        else:
+            # No fitness to weight by, every individual has the same chance
+            parentA = self.choice(self.population)
+            parentB = self.choice(self.population)
 
         self.new_population.extend(self.crossover(parentA, parentB))
 
+
+    def roulette_parents(self, size):
+        """
+        Returns the indexes of @param size genomes chosen by roulette, using the
+        same algorithm as roulette_reproduction: all the draws are searched at
+        once on the fitness prefix sums.
+
+        @param size: number of parents to choose
+        """
+        cumulative_fitness = np.cumsum(self.population['fitness_points'])
+        fitness_sum = cumulative_fitness[-1]
+        if fitness_sum <= 0:
+            return self.rng.integers(len(cumulative_fitness), size=size)
+
+        parents = np.searchsorted(cumulative_fitness, self.rng.random(size) * fitness_sum, \
+            side='right')
+        # Rounding may put a draw at the very end of the wheel
+        return np.minimum(parents, len(cumulative_fitness) - 1)
+
     def crossover(self, solutionA, solutionB):
         """
         Creates a new solution, crossingover solutionA and solutionB.
@@ -291,7 +818,7 @@ class StorySelector:
         """
         mutation_probability = self.config['mutation_probability']
         max_len = max(len(solutionA['solution']), len(solutionB['solution']))
-        cutpoints = [random.randrange(max_len + 1)]
+        cutpoints = [int(self.rng.integers(max_len + 1))]
         cutpoints.append(cutpoints[0] + 1)
 
         cutpoints = sorted(cutpoints)
@@ -308,16 +835,90 @@ class StorySelector:
         #Insert solutionA's cut in solutionB
         new_solutionB[cutpoints[0]:cutpoints[1]] = cutA
 
-        rand = random.random()
+        rand = self.rng.random()
         if(rand < mutation_probability):
             self.mutation(new_solutionA)
-        rand = random.random()
+        rand = self.rng.random()
         if(rand < mutation_probability):
             self.mutation(new_solutionB)
 
         return [{'solution': new_solutionA, 'fitness_points': self.fitness_points(new_solutionA)}, \
             {'solution': new_solutionB, 'fitness_points': self.fitness_points(new_solutionB)}]
 
+    def crossover_genomes(self, population, individualA, individualB, cutpoint):
+        """
+        Crosses over two genomes of the population in place.
+
+        Like crossover(), the assignment of a single story slot is switched
+        between the two genomes.
+
+        @param population: the population dict
+        @param individualA, individualB: the rows of the two genomes that will
+        be crossedover
+        @param cutpoint: the story slot, a random backlog story drawn by
+        reproduce_genomes
+        """
+        teamA = population['genomes'][individualA, cutpoint]
+        teamB = population['genomes'][individualB, cutpoint]
+        self.set_gene(population, individualA, cutpoint, teamB)
+        self.set_gene(population, individualB, cutpoint, teamA)
+
+    def local_search(self):
+        """
+        Memetic step: hill climbing on the best genomes of the population.
+
+        @algorithm Each move either reassigns a random backlog story to a
+        random team slot (or removes it from the sprint), or swaps the team
+        slots of two random backlog stories. The move is applied with set_gene,
+        so its fitness comes from the updated partial sums; it is kept if the
+        fitness improves and undone otherwise.
+
+        @config local_search_size: number of best genomes refined per generation
+        @config local_search_steps: moves tried on each genome, defaults to 10
+        """
+        population = self.population
+        backlog_stories = self.index.backlog_stories
+        if len(backlog_stories) == 0:
+            return
+        steps = self.config.get('local_search_steps', 10)
+        individuals = largest(population['fitness_points'], self.config['local_search_size'])
+        moves = self.rng.random((len(individuals), steps, 3)).tolist()
+        for individual, draws in zip(individuals, moves):
+            genome = population['genomes'][individual]
+            fitness = population['fitness_points'][individual]
+            for swap, first, second in draws:
+                story = backlog_stories[scaled(first, len(backlog_stories))]
+                if swap < 1/2:
+                    # Reassign: the last value stands for "not in the sprint"
+                    team = scaled(second, self.index.team_slots + 1)
+                    changes = [(story, team if team < self.index.team_slots else -1)]
+                else:
+                    other = backlog_stories[scaled(second, len(backlog_stories))]
+                    changes = [(story, genome[other]), (other, genome[story])]
+                previous = [(changed, genome[changed]) for changed, team in changes]
+                for changed, team in changes:
+                    self.set_gene(population, individual, changed, team)
+                new_fitness = self.individual_fitness(population, individual)
+                if new_fitness > fitness:
+                    fitness = new_fitness
+                else:
+                    for changed, team in reversed(previous):
+                        self.set_gene(population, individual, changed, team)
+            population['fitness_points'][individual] = fitness
+
+
+    def individual_fitness(self, population, individual):
+        """
+        Returns the fitness points of one genome from its partial sums, see
+        aggregates_fitness.
+
+        @param population: the population dict
+        @param individual: the row of the genome in the population
+        """
+        return self.aggregates_fitness({key: population[key][individual:individual + 1] \
+            for key in ('story_points', 'cost', 'team_hours', 'invalid_dependencies')})[0]
+
+
     def remove_duplicate_stories(self):
         """
         Removes repeated assignments in solution.
@@ -337,6 +938,55 @@ class StorySelector:
         self.new_population = unique_pop
 
 
+    def remove_clones(self):
+        """
+        Replaces the clones of the population, keeping the first individual of
+        each set of equal solutions (see solution_keys).
+
+        Returns the number of clones replaced.
+
+        @config clone_replacement: {mutation, random}, defaults to mutation.
+        mutation: the clone is mutated once (mutation_genome or mutation).
+        random: the clone is replaced by a new random solution
+        """
+        seen = set()
+        clones = []
+        for individual, key in enumerate(self.solution_keys()):
+            if key in seen:
+                clones.append(individual)
+            else:
+                seen.add(key)
+        if not clones:
+            return 0
+
+        random_replacement = self.config.get('clone_replacement', 'mutation') == 'random'
+        if self.array_genome:
+            population = self.population
+            if random_replacement:
+                fresh = self.generate_random_genomes(len(clones))
+                for key in population:
+                    population[key][clones] = fresh[key]
+            else:
+                for individual, draws in zip(clones, self.rng.random((len(clones), 5)).tolist()):
+                    self.mutation_genome(population, individual, draws)
+                population['fitness_points'][clones] = self.aggregates_fitness( \
+                    {key: population[key][clones] for key in ('story_points', 'cost', \
+                        'team_hours', 'invalid_dependencies')})
+            return len(clones)
+
+        for individual in clones:
+            if random_replacement:
+                self.population[individual] = self.generate_random_solution()
+            else:
+                solution = [dict(attribution) for attribution \
+                    in self.population[individual]['solution']]
+                self.mutation(solution)
+                self.population[individual] = {'solution': solution, \
+                    'fitness_points': self.fitness_points(solution)}
+
+        return len(clones)
+
+
     def select(self):
         """
         Creates a new population merging the new solutions.
@@ -345,6 +995,14 @@ class StorySelector:
         Accepted set {elitism, substitution}
         """
         selection_strategy = self.config['selection_strategy']
+        if self.array_genome:
+            # Genomes have one slot per story, there are no duplicates to remove
+            if selection_strategy == 'elitism':
+                self.elitism_select_genomes()
+            elif selection_strategy == 'steadyState':
+                self.steady_state_genomes()
+            return
+
         self.remove_duplicate_stories()
 
 
@@ -361,14 +1019,30 @@ class StorySelector:
         new solutions plus 1/10 best fit of the old generation.
         """
         elitism_size = int(len(self.population) / 10)
-        new_population = sorted(self.population, \
-            key=lambda x: x['fitness_points'], reverse=True)[:elitism_size]
-        new_population.extend(sorted(self.new_population, \
-            key=lambda x: x['fitness_points'])[elitism_size:])
+        new_population = heapq.nlargest(elitism_size, self.population, \
+            key=itemgetter('fitness_points'))
+        worst_new = set(heapq.nsmallest(elitism_size, range(len(self.new_population)), \
+            key=lambda i: self.new_population[i]['fitness_points']))
+        new_population.extend(solution for i, solution in enumerate(self.new_population) \
+            if i not in worst_new)
 
         self.population = new_population
 
 
+    def elitism_select_genomes(self):
+        """
+        Array version of elitism_select.
+        """
+        fitness = self.population['fitness_points']
+        elitism_size = int(len(fitness) / 10)
+        best_old = largest(fitness, elitism_size)
+        best_new = np.ones(len(self.new_population['fitness_points']), dtype=bool)
+        best_new[smallest(self.new_population['fitness_points'], elitism_size)] = False
+
+        self.population = {key: np.concatenate((self.population[key][best_old], \
+            self.new_population[key][best_new])) for key in self.population}
+
+
     def steady_state(self):
         """
         Creates the new population using the following algorithm.
@@ -378,54 +1052,578 @@ class StorySelector:
         """
         ss_size = int(len(self.population) / 10)
 
-        self.population = sorted(self.population, \
-            key=lambda x: x['fitness_points'])
-        new_population = sorted(self.new_population, \
-            key=lambda x: x['fitness_points'], reverse=True)
+        worst_old = heapq.nsmallest(ss_size, range(len(self.population)), \
+            key=lambda i: self.population[i]['fitness_points'])
+        best_new = heapq.nlargest(ss_size, self.new_population, \
+            key=itemgetter('fitness_points'))
 
-        for i in range(ss_size):
-            if self.population[i]['fitness_points'] < new_population[i]['fitness_points']:
-                self.population[i] = new_population[i]
+        for old, new in zip(worst_old, best_new):
+            if self.population[old]['fitness_points'] < new['fitness_points']:
+                self.population[old] = new
             else:
                 break
 
 
-    def run(self):
+    def steady_state_genomes(self):
         """
-        Run genetic algorithm to assign stories to teams
+        Array version of steady_state: the worst genomes are substituted in place.
         """
+        fitness = self.population['fitness_points']
+        new_fitness = self.new_population['fitness_points']
+        ss_size = int(len(fitness) / 10)
 
-        self.generate_population()
-        print('-----------Init--------------')
-        print(self.config)
+        worst_old = smallest(fitness, ss_size)
+        best_new = largest(new_fitness, ss_size)
+        # fitness[worst_old] grows and new_fitness[best_new] decreases, so the
+        # improving substitutions are a prefix
+        improving = np.count_nonzero(fitness[worst_old] < new_fitness[best_new])
 
-        fitness = []
-        best = 0
-        for i in range(100):
+        for key in self.population:
+            self.population[key][worst_old[:improving]] = \
+                self.new_population[key][best_new[:improving]]
+
+
+    def population_fitness(self):
+        """
+        Returns the fitness points of the population as a vector.
+        """
+        if self.array_genome:
+            return self.population['fitness_points']
+
+        return np.fromiter(map(itemgetter('fitness_points'), self.population), \
+            dtype=float, count=len(self.population))
+
+
+    def fitness_statistics(self):
+        """
+        Returns the (best, worst, mean) fitness points of the population.
+        """
+        if self.array_genome:
+            fitness = self.population['fitness_points']
+            worst = float(fitness.min())
+            best = float(fitness.max())
+        else:
+            worst = best = self.population[0]['fitness_points']
+            for solution in self.population:
+                if solution['fitness_points'] < worst:
+                    worst = solution['fitness_points']
+                elif solution['fitness_points'] > best:
+                    best = solution['fitness_points']
+
+        return best, worst, (best + worst) / 2
+
+
+    def best_solution(self):
+        """
+        Returns the attributions of the best fit individual of the population.
+        """
+        if self.array_genome:
+            best = np.argmax(self.population['fitness_points'])
+            return self.index.decode(self.population['genomes'][best])
+
+        return max(self.population, key=lambda x: x['fitness_points'])['solution']
+
+
+    def best_individuals(self, size):
+        """
+        Returns the @param size best fit individuals, as a list of solutions or
+        as a population dict in array genome mode.
+
+        @param size: number of individuals
+        """
+        if self.array_genome:
+            return self.take_genomes(self.population, \
+                largest(self.population['fitness_points'], size))
+
+        return heapq.nlargest(size, self.population, key=itemgetter('fitness_points'))
+
+
+    def immigrate(self, individuals):
+        """
+        Replaces the worst fit individuals of the population by @param individuals.
+
+        @param individuals: individuals returned by best_individuals
+        """
+        if self.array_genome:
+            worst = smallest(self.population['fitness_points'], \
+                len(individuals['fitness_points']))
+            for key in self.population:
+                self.population[key][worst] = individuals[key][:len(worst)]
+            return
+
+        worst = heapq.nsmallest(len(individuals), range(len(self.population)), \
+            key=lambda i: self.population[i]['fitness_points'])
+        for i, solution in zip(worst, individuals):
+            self.population[i] = solution
+
+
+    def evolve(self, generations, start_time=None, fitness=None):
+        """
+        Reproduces and selects the population for a number of generations.
+
+        Returns the (best, worst, mean) fitness points of each generation.
+
+        @param generations: number of generations
+        @param start_time: time.monotonic() at the start of the run. If given,
+        evolution stops as soon as stop_reason is met, the reason is kept in
+        self.stop_cause.
+        @param fitness: history of a resumed run, evolution continues until it
+        has @param generations entries unless the history already meets a stop
+        criterion
+        @config checkpoint_file: .npz file where the run is saved every
+        checkpoint_interval generations (default 10), see save_checkpoint
+        @config remove_clones: replace the clones of the population after each
+        selection, see remove_clones
+        """
+        if fitness is None:
+            fitness = []
+        if fitness and start_time is not None:
+            # A resumed run may have stopped when it was saved
+            self.stop_cause = self.stop_reason(fitness, start_time)
+            if self.stop_cause is not None:
+                return fitness
+        checkpoint_file = self.config.get('checkpoint_file')
+        checkpoint_interval = self.config.get('checkpoint_interval', 10)
+        if self.profiling:
+            # Time spent before the first generation only goes to the totals
+            self.take_profile(sys.getallocatedblocks())
+        while len(fitness) < generations:
+            if self.profiling:
+                allocated_blocks = sys.getallocatedblocks()
             self.reproduce()
             self.select()
+            clones = self.remove_clones() if self.config.get('remove_clones') else None
+            if self.array_genome and self.config.get('local_search_size', 0) > 0:
+                self.local_search()
+
+            fitness.append(self.fitness_statistics())
+            profile = self.take_profile(allocated_blocks) if self.profiling else None
+            diversity = None
+            if self.metrics_sinks:
+                diversity = self.diversity_metrics()
+                if clones is not None:
+                    diversity['clones'] = clones
+                self.emit_metrics(len(fitness), fitness[-1], diversity, \
+                    self.fitness_evaluations, profile)
+            if checkpoint_file and len(fitness) % checkpoint_interval == 0:
+                self.save_checkpoint(checkpoint_file, fitness)
+            if start_time is not None:
+                # The diversity of the metrics is not computed again
+                self.stop_cause = self.stop_reason(fitness, start_time, \
+                    diversity and diversity['diversity'])
+                if self.stop_cause is not None:
+                    break
+
+        return fitness
+
+
+    def save_checkpoint(self, file_name, fitness):
+        """
+        Saves the state of the run to a NumPy .npz file: configuration,
+        population, random generator, fitness history, fitness evaluations and
+        elapsed time. The file is replaced atomically, an interrupted save
+        leaves the previous checkpoint intact.
 
-            sorted_population = sorted(self.population, \
-                key=lambda x: x['fitness_points'])
-            worst = sorted_population[0]['fitness_points']
-            best = sorted_population[-1]['fitness_points']
-            mean = (sorted_population[0]['fitness_points'] + \
-                    sorted_population[-1]['fitness_points']) / 2
-            fitness.append((best, worst, mean))
+        List solutions are stored as story and team index arrays with the
+        length of each solution.
+
+        @param file_name: the checkpoint file
+        @param fitness: the (best, worst, mean) history of the run
+        """
+        state = {'rng_state': np.array(json.dumps(self.rng.bit_generator.state))}
+        state['config_name'] = np.array(self.config_name)
+        state['config'] = np.array(json.dumps(self.config))
+        state['history'] = np.array(fitness, dtype=float).reshape(-1, 3)
+        state['fitness_evaluations'] = np.array(self.fitness_evaluations)
+        state['elapsed'] = np.array(time.monotonic() - self.start_time)
+        if self.array_genome:
+            for key in self.population:
+                state['population_' + key] = self.population[key]
+        else:
+            state['solution_length'] = np.array([len(solution['solution']) \
+                for solution in self.population], dtype=np.intp)
+            state['solution_story'] = np.array([self.index.story_index[attribution['story_id']] \
+                for solution in self.population for attribution in solution['solution']], \
+                dtype=np.intp)
+            state['solution_team'] = np.array([self.index.team_index[attribution['team_id']] \
+                for solution in self.population for attribution in solution['solution']], \
+                dtype=np.intp)
+            state['solution_fitness'] = self.population_fitness()
+
+        with open(file_name + '.tmp', 'wb') as cfile:
+            np.savez(cfile, **state)
+        os.replace(file_name + '.tmp', file_name)
+
+
+    def load_checkpoint(self, file_name):
+        """
+        Restores the population, random generator, fitness evaluations and
+        elapsed time saved by save_checkpoint. Returns the fitness history.
+
+        @param file_name: the checkpoint file
+        """
+        with np.load(file_name) as state:
+            self.rng.bit_generator.state = json.loads(str(state['rng_state']))
+            self.fitness_evaluations = int(state['fitness_evaluations'])
+            self.start_time = time.monotonic() - float(state['elapsed'])
+            if self.array_genome:
+                self.population = {key[len('population_'):]: state[key] \
+                    for key in state.files if key.startswith('population_')}
+            else:
+                ends = np.cumsum(state['solution_length'])
+                stories = state['solution_story']
+                teams = state['solution_team']
+                self.population = [{'solution': [{'team_id': self.index.team_ids[teams[i]], \
+                    'story_id': self.index.story_ids[stories[i]]} \
+                    for i in range(end - length, end)], 'fitness_points': float(fitness_points)} \
+                    for end, length, fitness_points in zip(ends, state['solution_length'], \
+                        state['solution_fitness'])]
+
+            return [tuple(stats) for stats in state['history'].tolist()]
+
+
+    @staticmethod
+    def checkpoint_config(file_name):
+        """
+        Returns the (config_name, config) of a checkpoint, to resume it.
+
+        @param file_name: the checkpoint file
+        """
+        with np.load(file_name) as state:
+            return str(state['config_name']), json.loads(str(state['config']))
+
+
+    def emit_metrics(self, generation, statistics, diversity, evaluations, profile=None):
+        """
+        Sends the metrics record of a generation to the metrics sinks: the
+        metrics_file writer and the metrics callback.
+
+        @param generation: the generation number, starting at 1
+        @param statistics: the (best, worst, mean) fitness points
+        @param diversity: the diversity metrics, see diversity_metrics, and
+        the number of clones replaced when remove_clones is set
+        @param evaluations: fitness evaluations since the start of the run
+        @param profile: phase times of the generation, see take_profile
+        """
+        best, worst, mean = statistics
+        record = {'config': self.config_name, 'generation': generation, 'best': best, \
+            'worst': worst, 'mean': mean, 'diversity': diversity['diversity'], \
+            'hamming': diversity['hamming'], 'evaluations': evaluations, \
+            'time': time.monotonic() - self.start_time}
+        if 'clones' in diversity:
+            record['clones'] = diversity['clones']
+        if profile is not None:
+            record.update(profile)
+        for sink in self.metrics_sinks:
+            sink(record)
+
+
+    def stop_reason(self, fitness, start_time, diversity=None):
+        """
+        Returns why the run should stop after the generations of @param fitness,
+        or None to continue.
+
+        @param fitness: the (best, worst, mean) history of the run
+        @param start_time: time.monotonic() at the start of the run
+        @param diversity: the population diversity, computed if not given
+        @config max_generations: maximum number of generations, defaults to 100
+        @config time_budget: maximum run time in seconds
+        @config stagnation_generations: stop when the best fitness points did not
+        improve for this number of generations
+        @config min_diversity: stop when population_diversity is below this ratio
+        """
+        if len(fitness) >= self.config.get('max_generations', GENERATIONS):
+            return 'max_generations'
+
+        time_budget = self.config.get('time_budget')
+        if time_budget is not None and time.monotonic() - start_time >= time_budget:
+            return 'time_budget'
+
+        window = self.config.get('stagnation_generations')
+        if window and len(fitness) > window and \
+            max(stats[0] for stats in fitness[-window:]) \
+                <= max(stats[0] for stats in fitness[:-window]):
+            return 'stagnation'
+
+        min_diversity = self.config.get('min_diversity')
+        if min_diversity is not None:
+            if diversity is None:
+                diversity = self.population_diversity()
+            if diversity < min_diversity:
+                return 'diversity'
+
+        return None
+
+
+    def population_diversity(self):
+        """
+        Returns the ratio of distinct solutions in the population, from 1/size
+        (all clones) to 1 (no two equal solutions).
+        """
+        keys = self.solution_keys()
+        return len(set(keys)) / len(keys)
+
+
+    def solution_keys(self):
+        """
+        Returns a hashable key per individual, equal for equal solutions: the
+        bytes of the genome, or the sorted attributions of a list solution.
+        """
+        if self.array_genome:
+            return [genome.tobytes() for genome in self.population['genomes']]
+
+        return [tuple(sorted((attribution['story_id'], attribution['team_id']) \
+            for attribution in solution['solution'])) for solution in self.population]
+
+
+    def mean_hamming_distance(self):
+        """
+        Returns the mean Hamming distance between two individuals of the
+        population, as the ratio of backlog stories whose team slot differs
+        (or that are in one sprint only): 0 when all are clones, 1 when no two
+        individuals share an assignment.
+
+        @algorithm For each story the pairs of individuals with the same value
+        are the sum of count(value)^2 over the values taken by the story, so
+        the distance comes from a bincount of the genomes in O(size * stories)
+        instead of comparing every pair.
+        """
+        if self.array_genome:
+            genomes = self.population['genomes']
+        else:
+            genomes = np.array([self.index.encode(solution['solution']) \
+                for solution in self.population])
+        size = len(genomes)
+        backlog_stories = self.index.backlog_stories
+        if size < 2 or len(backlog_stories) == 0:
+            return 0.0
+
+        values = self.index.team_slots + 1
+        block = max(1, FITNESS_BLOCK // size)
+        equal_pairs = 0
+        for start in range(0, len(backlog_stories), block):
+            columns = genomes[:, backlog_stories[start:start + block]].astype(np.intp) + 1
+            # A separate range of bins for each story
+            columns += values * np.arange(columns.shape[1])
+            counts = np.bincount(columns.ravel())
+            equal_pairs += int(counts @ counts)
+        # Ordered pairs, each individual is equal to itself
+        different_pairs = size * size * len(backlog_stories) - equal_pairs
+        return different_pairs / (size * (size - 1) * len(backlog_stories))
+
+
+    def diversity_metrics(self):
+        """
+        Returns the diversity of the population: {'diversity': ratio of
+        distinct solutions, 'hamming': mean Hamming distance}.
+        """
+        return {'diversity': self.population_diversity(), \
+            'hamming': self.mean_hamming_distance()}
+
+
+    def run_islands(self):
+        """
+        Island model: the population is split in islands evolved on separate
+        processes. Every migration_interval generations the migration_size best
+        individuals of each island replace the worst of the next island (ring).
+
+        Returns the (best, worst, mean) history over all the islands, the best
+        fitness points and its solution. Stop criteria (see stop_reason) are
+        checked between migrations, with the mean diversity metrics of the
+        islands.
+
+        @config islands: number of islands (processes)
+        @config migration_interval: generations between migrations, defaults to 10
+        @config migration_size: individuals sent by each island, defaults to 1
+        """
+        islands = self.config['islands']
+        interval = self.config.get('migration_interval', 10)
+        # Metrics are emitted by the main process only, island runs are not
+        # checkpointed
+        island_config = dict(self.config, islands=1, metrics_file=None, checkpoint_file=None, \
+            profile=False, \
+            population_size=self.config['population_size'] // islands)
+
+        connections = []
+        processes = []
+        for seed in self.seed_sequence.spawn(islands):
+            connection, island_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=island_worker, daemon=True, \
+                args=(island_connection, island_config, self.stories, self.teams, \
+                    self.config_name, seed))
+            process.start()
+            connections.append(connection)
+            processes.append(process)
+
+        max_generations = self.config.get('max_generations', GENERATIONS)
+        start_time = time.monotonic()
+        fitness = []
+        immigrants = [None] * islands
+        for start in range(0, max_generations, interval):
+            generations = min(interval, max_generations - start)
+            for i in range(islands):
+                connections[i].send((generations, immigrants[i]))
+            results = [connection.recv() for connection in connections]
+            errors = [result['error'] for result in results if 'error' in result]
+            if errors:
+                for connection in connections:
+                    connection.send(None)
+                for process in processes:
+                    process.join()
+                raise errors[0]
+
+            diversity = {key: sum(result['diversity'][key] for result in results) / islands \
+                for key in results[0]['diversity']}
+            evaluations = sum(result['evaluations'] for result in results)
+            for history in zip(*[result['history'] for result in results]):
+                best = max(stats[0] for stats in history)
+                worst = min(stats[1] for stats in history)
+                fitness.append((best, worst, (best + worst) / 2))
+                if self.metrics_sinks:
+                    self.emit_metrics(len(fitness), fitness[-1], diversity, evaluations)
+            # Ring migration: island i receives the best of island i - 1
+            immigrants = [results[i - 1]['emigrants'] for i in range(islands)]
+
+            self.stop_cause = self.stop_reason(fitness, start_time, diversity['diversity'])
+            if self.stop_cause is not None:
+                break
+
+        for connection in connections:
+            connection.send(None)
+        for process in processes:
+            process.join()
+
+        best = max(results, key=itemgetter('fitness_points'))
+        return fitness, best['fitness_points'], best['solution']
+
+
+    def run(self, checkpoint=None):
+        """
+        Run genetic algorithm to assign stories to teams
+
+        Returns a dict with the best fitness_points, its solution and the
+        history of (best, worst, mean) fitness points of each generation.
+        The run stops at the first stop criteria met, see stop_reason.
+
+        @param checkpoint: checkpoint file of a run to resume instead of
+        starting from a random population (see save_checkpoint)
+        @config islands: number of processes evolving parts of the population,
+        defaults to 1 (see run_islands)
+        @config metrics_file: JSON Lines (or .csv) file receiving the metrics of
+        each generation as the run goes, appended to when resuming
+        @config plot: plot the fitness history at the end of the run, defaults
+        to true
+        """
+
+        print('-----------Init--------------')
+        print(self.config)
+
+        self.stop_cause = None
+        self.start_time = time.monotonic()
+        writer = None
+        if self.config.get('metrics_file'):
+            writer = MetricsWriter(self.config['metrics_file'], append=checkpoint is not None)
+            self.metrics_sinks.append(writer)
+        try:
+            if self.config.get('islands', 1) > 1:
+                fitness, best, solution = self.run_islands()
+            else:
+                fitness = []
+                if checkpoint is None:
+                    self.generate_population()
+                else:
+                    fitness = self.load_checkpoint(checkpoint)
+                fitness = self.evolve(self.config.get('max_generations', GENERATIONS), \
+                    self.start_time, fitness)
+                best = fitness[-1][0]
+                solution = self.best_solution()
+        finally:
+            if writer is not None:
+                self.metrics_sinks.remove(writer)
+                writer.close()
 
         print(best)
-        print(sorted_population[-1]['solution'])
-        self.plot(fitness, best)
+        print(solution)
+        if self.config.get('plot', True):
+            self.plot(fitness, best)
+
+        return {'fitness_points': best, 'solution': solution, 'history': fitness, \
+            'generations': len(fitness), 'stop_cause': self.stop_cause, \
+            'fitness_cache': {'hits': self.fitness_cache_hits, \
+                'misses': self.fitness_cache_misses}, \
+            'profile': self.profile_totals if self.profiling else None}
 
     def plot(self, fitness, best):
-        lines = plt.plot(fitness)
-        plt.setp(lines, linewidth=2.0)
-        plt.xlabel('Iteração')
-        plt.ylabel('Fitness')
-        plt.title('Melhor, pior e fitness médio da população')
-        plt.setp(lines[0], marker='None')
-        plt.setp(lines[1], marker='None')
-        plt.setp(lines[2], marker='None')
-        plt.legend(lines, ['Melhor solução', 'Pior solução', 'Média'], loc=4)
-        plt.savefig('images/' + self.config_name + '_' + str(best) + '.png')
-        plt.clf()
+        plot_history(fitness, 'images/' + self.config_name + '_' + str(best) + '.png')
+
+
+def scaled(draw, size):
+    """
+    Returns a random index in range(@param size) from a uniform @param draw
+    in [0, 1).
+    """
+    # Rounding of draw * size may reach size
+    return min(int(draw * size), size - 1)
+
+
+def smallest(values, size):
+    """
+    Returns the indexes of the @param size smallest @param values in ascending
+    order. Only the selected values are sorted (numpy.argpartition).
+
+    @param values: 1-D array
+    @param size: number of indexes
+    """
+    size = min(max(size, 0), len(values))
+    if size == 0:
+        return np.empty(0, dtype=np.intp)
+    rows = np.argpartition(values, size - 1)[:size]
+    return rows[np.argsort(values[rows], kind='stable')]
+
+
+def largest(values, size):
+    """
+    Returns the indexes of the @param size largest @param values in descending
+    order, see smallest.
+    """
+    return smallest(-values, size)
+
+
+def island_worker(connection, config, backlog, teams, config_name, seed):
+    """
+    Process of an island of StorySelector.run_islands.
+
+    Receives (generations, immigrants) commands, evolves the island and sends
+    back a dict with the history, the emigrants, the best fitness_points and
+    solution, the diversity and the fitness evaluations of the island. A None
+    command stops the process. An exception of the island is sent as
+    {'error': exception}, re-raised by the main process.
+
+    @param connection: the island end of the pipe to the main process
+    @param seed: SeedSequence of the island random generator
+    """
+    try:
+        island = StorySelector(config, backlog, teams, config_name, seed=seed)
+        island.generate_population()
+        migration_size = config.get('migration_size', 1)
+        while True:
+            command = connection.recv()
+            if command is None:
+                break
+            generations, immigrants = command
+            if immigrants is not None:
+                island.immigrate(immigrants)
+            history = island.evolve(generations)
+            connection.send({'history': history, \
+                'emigrants': island.best_individuals(migration_size), \
+                'fitness_points': island.fitness_statistics()[0], \
+                'solution': island.best_solution(), \
+                'diversity': island.diversity_metrics(), \
+                'evaluations': island.fitness_evaluations})
+    except Exception as error:
+        connection.send({'error': error})
+        # Commands already sent are ignored until the main process stops the island
+        while connection.recv() is not None:
+            pass
+
+    connection.close()
@@ -0,0 +1,48 @@
+# Copyright 2016 (C) Thiago Pinto.
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+"""
+Regression checks of the CSV loading of ColumnTable.
+
+    python3 -m unittest test_column_table
+"""
+__author__ = "Thiago Pinto"
+
+import os
+import tempfile
+import unittest
+from column_table import ColumnTable
+
+BACKLOG = 'id,story_desc,dependency,priority,time,status\n' \
+    'A1,First,,0.5,3,backlog\n' \
+    'B1,Second,A1,0.2,5,backlog\n'
+
+
+class ReadCsvTest(unittest.TestCase):
+
+    def read(self, text):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as csvfile:
+            csvfile.write(text)
+        self.addCleanup(os.remove, csvfile.name)
+        return ColumnTable.read_csv(csvfile.name)
+
+
+    def test_blank_lines_are_skipped(self):
+        table = self.read(BACKLOG + '\n')
+        self.assertEqual(table.ids.tolist(), ['A1', 'B1'])
+
+
+    def test_short_row_names_the_line(self):
+        with self.assertRaisesRegex(ValueError, 'line 3'):
+            self.read(BACKLOG.replace(',5,backlog', ',5'))
+
+
+    def test_empty_dependency_ids_are_ignored(self):
+        table = self.read(BACKLOG.replace('Second,A1,', 'Second,",A1,",'))
+        self.assertEqual(table.to_dict()['B1']['dependency'], 'A1')
+
+
+if __name__ == '__main__':
+    unittest.main()
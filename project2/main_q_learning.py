@@ -3,9 +3,9 @@
 Based on: https://github.com/ronekko/basic_reinforcement_learning
 """
 
+import sys
 import time
 import numpy as np
-import matplotlib.pyplot as plt
 import vrep
 import contexttimer
 from environment import Robot
@@ -121,6 +121,9 @@ class Agent(object):
         self.isDown = False
 
     def plot(self, body_trajectory, joints_trajectory, return_history, q_table):
+        # Imported on use, runs without plots do not pay for matplotlib
+        import matplotlib.pyplot as plt
+
         fig = plt.figure(figsize=(9, 4))
         T = len(body_trajectory)
 
@@ -163,7 +166,34 @@ class Agent(object):
         plt.draw()
 
 
+def plot_run(return_history, body_trajectory):
+    """
+    Plots the return of each episode and the body trajectory of the last one.
+    """
+    import matplotlib.pyplot as plt
+
+    plt.grid()
+    plt.plot(return_history)
+    plt.title('Return (total reward in a episode)')
+    plt.xlabel('episode')
+    plt.ylabel('position [m]')
+    plt.show()
+
+    T = len(body_trajectory)
+
+    # plot an xyz trajectory of the body
+    plt.grid()
+    plt.plot(np.arange(T) * 0.05, np.array(body_trajectory))
+    plt.title('Position of the body')
+    plt.ylabel('position [m]')
+    plt.legend(['x', 'y', 'z'], loc='best')
+    plt.show()
+
+
 if __name__ == '__main__':
+    # --no-plot: skip the plots (and the matplotlib import) at the end
+    no_plot = '--no-plot' in sys.argv
+
     try:
         client_id
     except NameError:
@@ -218,21 +248,7 @@ if __name__ == '__main__':
     except KeyboardInterrupt:
         print "Terminated by `Ctrl+c` !!!!!!!!!!"
 
-    plt.grid()
-    plt.plot(return_history)
-    plt.title('Return (total reward in a episode)')
-    plt.xlabel('episode')
-    plt.ylabel('position [m]')
-    plt.show()
-
-    T = len(body_trajectory)
-
-    # plot an xyz trajectory of the body
-    plt.grid()
-    plt.plot(np.arange(T) * 0.05, np.array(body_trajectory))
-    plt.title('Position of the body')
-    plt.ylabel('position [m]')
-    plt.legend(['x', 'y', 'z'], loc='best')
-    plt.show()
+    if not no_plot:
+        plot_run(return_history, body_trajectory)
 
     e = vrep.simxStopSimulation(client_id, vrep.simx_opmode_oneshot_wait)